@@ -1,21 +1,69 @@
-import base64
+from typing import Callable
+import hashlib
 import sqlite3
-from datetime import datetime
-from io import BytesIO
 
-from flask import Flask, redirect, render_template, request, url_for
-from matplotlib.figure import Figure
+from flask import (
+    Flask,
+    Response,
+    abort,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from werkzeug.http import is_resource_modified
 from wtforms import DateField, FloatField, Form, StringField, TextAreaField
 from wtforms.validators import Optional
 
-from diary.core import Diary
-from diary.db import create_diary, load_diary, update_diary
-from diary.nlp import stats, sentiment
-from diary.search import date_filter, metric_filter, strict_search
+from diary.core import Diary, Entry
+from diary.db import (
+    create_diary,
+    create_entry,
+    find_diary,
+    iter_entries,
+    latest_entry,
+    load_diary,
+    metric_names,
+    metric_version,
+    recent_entries,
+)
+from diary.derived import DERIVED_PREFIX, DerivedMetricWriter
+from diary.graphs import GraphCache
+from diary.nlp import sentiment_batch
+from diary.search import EntryQuery
 
 app = Flask(__name__)
 
 app.config["DB_ADDRESS"] = "tmp/main.db"
+app.config["PAGE_SIZE"] = 100
+# Graphs are downsampled to at most this many points, a few hundred pixels wide
+# can't show more, and rendering time grows with the number of points
+app.config["GRAPH_POINTS"] = 500
+app.config["GRAPH_CACHE_BYTES"] = 32 * 1024 * 1024
+# Seconds the /metrics page may spend rendering its graphs in parallel, so the
+# images it links to are already cached, 0 leaves each to render when it's fetched
+app.config["GRAPH_RENDER_BUDGET"] = 2.0
+# A directory to also keep rendered graphs in, across restarts, e.g. "tmp/graphs"
+app.config["GRAPH_CACHE_DIR"] = None
+# Analyse new entries in the background and store the results as nlp. metrics
+app.config["DERIVE_METRICS"] = True
+
+# Made from the config on import, replace it to change the settings later
+graph_cache = GraphCache(app.config["GRAPH_CACHE_BYTES"], app.config["GRAPH_CACHE_DIR"])
+metric_writer = DerivedMetricWriter()
+# The derived metric graphed as mood, VADER's compound sentiment from sentiment_batch
+MOOD = "compound"
+MOOD_METRIC = DERIVED_PREFIX + MOOD
+
+
+@app.template_filter()
+def written_metrics(metrics: dict[str, float]) -> dict[str, float]:
+    """The metrics written in an entry's text, without those derived from it"""
+    return {
+        metric: value
+        for metric, value in metrics.items()
+        if not metric.startswith(DERIVED_PREFIX)
+    }
 
 
 @app.route("/")
@@ -27,55 +75,163 @@ def hello_world():
 
 @app.route("/read/<username>")
 def read(username):
-    """Read entries from the diary associated with a user in the database"""
+    """Read a page of entries from the diary associated with a user in the database,
+    with a link to the next page if there is one."""
+
+    uuid, name = find_diary(app.config["DB_ADDRESS"], username)
+    page_size = app.config["PAGE_SIZE"]
+    entries = list(
+        iter_entries(
+            app.config["DB_ADDRESS"],
+            username,
+            after_timestamp=request.args.get("after"),
+            after_uuid=request.args.get("after_uuid"),
+            limit=page_size + 1,
+        )
+    )
+    next_page = None
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        next_page = url_for(
+            "read",
+            username=username,
+            after=entries[-1].timestamp,
+            after_uuid=entries[-1].uuid,
+        )
+    diary = Diary(name, entries, uuid)
+    return render_template("read.html", diary=diary, next_page=next_page)
+
+
+def graph_response(uuid: str, graph: str, render: Callable[[], bytes]) -> Response:
+    """Serve a PNG graph of a diary, with an ETag from its latest entry and the
+    version of its metrics, which also changes when metrics are written after their
+    entry. There's no Last-Modified, the latest entry's timestamp doesn't change
+    when metrics are written or deleted later, or an older entry is added.
+    A conditional request for an unchanged graph gets a 304 without rendering.
+    Browsers cache the graph, but check it's up to date on each view."""
+    latest = latest_entry(app.config["DB_ADDRESS"], uuid)
+
+    def current_etag() -> str:
+        return hashlib.sha1(
+            repr(
+                (
+                    uuid,
+                    latest,
+                    metric_version(app.config["DB_ADDRESS"], uuid),
+                    graph,
+                    sorted(request.args.items()),
+                    app.config["GRAPH_POINTS"],
+                )
+            ).encode()
+        ).hexdigest()
 
-    diary = load_diary(app.config["DB_ADDRESS"], username)
-    return render_template("read.html", diary=diary)
+    etag = current_etag()
+    if is_resource_modified(request.environ, etag=etag):
+        response = Response(render(), mimetype="image/png")
+        # Rendering may have written metrics, e.g. mood_png's backfill
+        etag = current_etag()
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def downsample(X, Y):
+    """Reduce a series to at most GRAPH_POINTS points, keeping its shape"""
+    from diary.series import lttb
+
+    return lttb(X, Y, app.config["GRAPH_POINTS"])
+
+
+def metric_graphs(
+    username: str, resolution: str, metric: str | None = None
+) -> dict[str, tuple]:
+    """The series to plot for each metric, or just the one given, at a resolution"""
+    from diary.series import load_metric_rollups, load_metric_series
+
+    if resolution == "raw":
+        series = load_metric_series(app.config["DB_ADDRESS"], username, metric)
+    else:
+        rollups = load_metric_rollups(
+            app.config["DB_ADDRESS"], username, resolution, metric
+        )
+        series = {name: (rollup.times, rollup.mean) for name, rollup in rollups.items()}
+    return {name: downsample(X, Y) for name, (X, Y) in series.items()}
 
 
-def plot_to_base64(X, Y) -> str:
-    fig = Figure()
-    ax = fig.subplots()
-    ax.plot(X, Y)
-    buf = BytesIO()
-    fig.savefig(buf, format="png")
-    return base64.b64encode(buf.getbuffer()).decode("ascii")
+def get_resolution() -> str:
+    """The resolution asked for by ?resolution=, aborting if it isn't one we have"""
+    from diary.series import RESOLUTIONS
 
+    resolution = request.args.get("resolution", "raw")
+    if resolution != "raw" and resolution not in RESOLUTIONS:
+        abort(400, f"resolution should be raw or one of {', '.join(RESOLUTIONS)}")
+    return resolution
 
-@app.route("/mood/username")
+
+@app.route("/mood/<username>")
 def mood(username):
-    """Make graphs of mood from the diary for the user"""
-    diary = load_diary(username)
-    X = []
-    Y = []
-    for entry in diary.entries:
-        X.append(entry.time)
-        Y.append(sentiment(entry.texts)["compound"])
+    """A page of graphs of mood from the diary for the user, see mood_png."""
+    _, name = find_diary(app.config["DB_ADDRESS"], username)
+    graphs = {"mood": url_for("mood_png", username=username)}
+    return render_template("graphs.html", name=name, graphs=graphs)
 
-    graph = plot_to_base64(X, Y)
 
-    return render_template("graphs.html", diary=diary, graph=graph)
+@app.route("/mood/<username>.png")
+def mood_png(username):
+    """A graph of mood from the diary for the user, its MOOD_METRIC.
+    Entries without it, e.g. from before DERIVE_METRICS, have their sentiment
+    analysed when the graph is rendered, so only once each."""
+    uuid, _ = find_diary(app.config["DB_ADDRESS"], username)
 
+    def render() -> bytes:
+        from diary.series import load_metric_series, to_datetime64
 
-@app.route("/metrics/username")
-def metrics(username):
-    """Make graphs of metrics from the diary for the user"""
-    diary = load_diary(username)
-    metrics: dict[str, tuple[list[datetime], list[float]]] = {}
-    for entry in diary.entries:
-        entry_stats = entry.metrics
-        for metric, value in entry_stats.items():
-            try:
-                metrics[metric][0].append(entry.time)
-                metrics[metric][1].append(value)
-            except KeyError:
-                metrics[metric] = ([entry.time], [value])
+        metric_writer.backfill(app.config["DB_ADDRESS"], uuid, MOOD, sentiment_batch)
+        series = load_metric_series(app.config["DB_ADDRESS"], username, MOOD_METRIC)
+        X, Y = series.get(MOOD_METRIC, (to_datetime64([]), []))
+        return graph_cache.png("mood", *downsample(X, Y))
 
-    graphs: dict[str, str] = {}
-    for metric, (X, Y) in metrics.items():
-        graphs[metric] = plot_to_base64(X, Y)
+    return graph_response(uuid, "mood", render)
 
-    return render_template("graphs.html", diary=diary, graphs=graphs)
+
+@app.route("/metrics/<username>")
+def metrics(username):
+    """A page of graphs of metrics from the diary for the user, see metric_png.
+    The graphs are rendered in parallel first, for up to GRAPH_RENDER_BUDGET seconds,
+    so the browser finds them cached rather than waiting for each in turn."""
+    resolution = get_resolution()
+    uuid, name = find_diary(app.config["DB_ADDRESS"], username)
+    if app.config["GRAPH_RENDER_BUDGET"]:
+        graph_cache.render_all(
+            metric_graphs(username, resolution),
+            timeout=app.config["GRAPH_RENDER_BUDGET"],
+        )
+    args = {} if resolution == "raw" else {"resolution": resolution}
+    graphs = {
+        metric: url_for("metric_png", username=username, metric=metric, **args)
+        for metric in metric_names(app.config["DB_ADDRESS"], uuid)
+    }
+    return render_template("graphs.html", name=name, graphs=graphs)
+
+
+@app.route("/metrics/<username>/<metric>.png")
+def metric_png(username, metric):
+    """A graph of a metric from the diary for the user.
+    With ?resolution=day, week or month the mean per bucket is plotted, from the
+    rollups kept by the database, rather than every value."""
+    resolution = get_resolution()
+    uuid, _ = find_diary(app.config["DB_ADDRESS"], username)
+
+    def render() -> bytes:
+        graphs = metric_graphs(username, resolution, metric)
+        if metric not in graphs:
+            abort(404)
+        return graph_cache.png(metric, *graphs[metric])
+
+    return graph_response(uuid, f"metric {metric}", render)
 
 
 class CreateForm(Form):
@@ -107,15 +263,19 @@ class AddForm(Form):
 
 @app.route("/add/<username>", methods=["GET", "POST"])
 def add(username):
-    """Add a new entry in the diary associated with a user in the database and then save it"""
+    """Add a new entry in the diary associated with a user in the database and then save it.
+    Only the latest entries are shown, so adding doesn't load the whole diary.
+    Its derived metrics are written by metric_writer once it's been analysed."""
 
-    diary = load_diary(app.config["DB_ADDRESS"], username)
+    uuid, name = find_diary(app.config["DB_ADDRESS"], username)
     form = AddForm(request.form)
     if request.method == "POST" and form.validate():
-        diary.add(form.entry_text.data)
-        update_diary(app.config["DB_ADDRESS"], diary)
-        return render_template("add.html", form=form, diary=diary)
-    return render_template("add.html", form=form, diary=diary)
+        entry = Entry.create(form.entry_text.data)
+        create_entry(app.config["DB_ADDRESS"], uuid, entry)
+        if app.config["DERIVE_METRICS"]:
+            metric_writer.submit(app.config["DB_ADDRESS"], uuid, entry)
+    entries = recent_entries(app.config["DB_ADDRESS"], uuid, app.config["PAGE_SIZE"])
+    return render_template("add.html", form=form, diary=Diary(name, entries, uuid))
 
 
 class SearchForm(Form):
@@ -159,10 +319,8 @@ def search(username):
     """Search over the entries from the diary associated with a user in the database
     Including some limited validation to ensure requirements are consistent."""
 
-    diary = load_diary(app.config["DB_ADDRESS"], username)
     form = SearchForm(request.form)
     if request.method == "POST" and form.validate():
-        entries = strict_search(diary, form.search_term.data)
         try:
             after = form.after.data.isoformat()
         except AttributeError:
@@ -171,16 +329,18 @@ def search(username):
             before = form.before.data.isoformat()
         except AttributeError:
             before = None
-        entries = date_filter(entries, after=after, before=before)
-        if form.metric.data:
-            entries = metric_filter(
-                entries,
-                metric=form.metric.data,
-                lt=form.lt.data,
-                gt=form.gt.data,
-                eq=form.eq.data,
-            )
+        query = EntryQuery(
+            search_term=form.search_term.data,
+            before=before,
+            after=after,
+            metric=form.metric.data,
+            lt=form.lt.data,
+            gt=form.gt.data,
+            eq=form.eq.data,
+        )
+        entries = query.execute(app.config["DB_ADDRESS"], username)
         return render_template("search.html", form=form, entries=entries)
+    diary = load_diary(app.config["DB_ADDRESS"], username)
     return render_template("search.html", form=form, entries=diary.entries)
 
 
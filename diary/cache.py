@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+import threading
+
+
+class LRUCache:
+    """A thread-safe cache which evicts the least recently used items once the total
+    weight of its contents passes max_weight. By default every item weighs 1.
+    Counts hits and misses so the hit rate can be monitored.
+
+    Writers should call self.invalidate (or self.clear), which bumps self.generation.
+    A reader which loads a value can pass the generation from before the load to
+    self.put so that a value which went stale during the load isn't stored.
+    """
+
+    def __init__(self, max_weight: int, weigh: Callable[[Any], int] = lambda value: 1):
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Store a value, unless the cache has been invalidated since generation."""
+        weight = self.weigh(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._remove(key)
+            if weight > self.max_weight:
+                return
+            self._items[key] = (value, weight)
+            self.weight += weight
+            while self.weight > self.max_weight:
+                self._remove(next(iter(self._items)))
+
+    def invalidate(self, predicate: Callable[[Hashable, Any], bool]) -> None:
+        """Remove every item for which predicate(key, value) is true."""
+        with self._lock:
+            self.generation += 1
+            for key, (value, _) in list(self._items.items()):
+                if predicate(key, value):
+                    self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._items.clear()
+            self.weight = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def _remove(self, key: Hashable) -> None:
+        try:
+            _, weight = self._items.pop(key)
+        except KeyError:
+            return
+        self.weight -= weight
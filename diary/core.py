@@ -1,18 +1,46 @@
 from dataclasses import dataclass, asdict
 from datetime import datetime
-from typing import TextIO
+from typing import TYPE_CHECKING, NoReturn, TextIO
 import json
 import re
+import sys
 
 from .utils import default_uuid
 
+if TYPE_CHECKING:
+    import numpy
 
-@dataclass
+
+class _EmptyMetrics(dict):
+    """An immutable empty dict, one instance is shared by every entry without metrics."""
+
+    def _immutable(self, *args, **kwargs) -> NoReturn:
+        raise TypeError("EMPTY_METRICS is shared and can't be modified")
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable  # type: ignore
+    __ior__ = _immutable  # type: ignore
+
+
+EMPTY_METRICS: dict[str, float] = _EmptyMetrics()
+
+
+def compact_metrics(metrics: dict[str, float]) -> dict[str, float]:
+    """Intern the metric names, so each is only stored once however many entries use
+    it, and swap an empty dict for EMPTY_METRICS."""
+    if not metrics:
+        return EMPTY_METRICS
+    return {sys.intern(metric): value for metric, value in metrics.items()}
+
+
+@dataclass(slots=True)
 class Entry:
     """Individual diary entry.
     To instantiate pass the text to .create(), this will auto-populate the current date
     and will detect metrics written in the form `#keyword 10.0`.
     Timestamp is a string in iso format to allow stringwise comparison.
+    Entries are slotted, and metric names interned, to keep large diaries compact.
+    Entries without metrics share EMPTY_METRICS, so replace rather than update it.
     """
 
     timestamp: str
@@ -26,7 +54,7 @@ class Entry:
             metric: float(value)
             for metric, value in re.findall(r"#(\w+) (\d+\.?\d*)", text)
         }
-        return cls(datetime.now().isoformat(), text, metrics)
+        return cls(datetime.now().isoformat(), text, compact_metrics(metrics))
 
     def __str__(self) -> str:
         return f"{self.timestamp} - {self.text}"
@@ -50,6 +78,35 @@ class Diary:
     def add(self, text: str) -> None:
         self.entries.append(Entry.create(text))
 
+    def timestamps(self) -> "numpy.ndarray":
+        """The time of every entry as a numpy datetime64 array"""
+        return self._columns()[0]
+
+    def metric_series(self) -> "dict[str, tuple[numpy.ndarray, numpy.ndarray]]":
+        """For each metric a pair of numpy arrays, of the times of the entries
+        recording it and of the values recorded"""
+        return self._columns()[1]
+
+    def _columns(self):
+        """The arrays are built once and kept until entries are added.
+        They live outside the dataclass fields, so aren't saved or compared."""
+        # Imported here so numpy is only loaded if it's needed
+        from . import series
+
+        version = len(self.entries)
+        try:
+            cached_version, columns = self.__dict__["_column_cache"]
+            if cached_version == version:
+                return columns
+        except KeyError:
+            pass
+        columns = (
+            series.timestamps(self.entries),
+            series.metric_series(self.entries),
+        )
+        self.__dict__["_column_cache"] = (version, columns)
+        return columns
+
     def __str__(self) -> str:
         return f"{self.name} with {len(self.entries)} entries"
 
@@ -57,7 +114,10 @@ class Diary:
     def from_dict(cls, dump: dict) -> "Diary":
         """The inverse of dataclasses.asdict"""
         entry_dicts = dump.pop("entries")
-        entries = [Entry(**entry_dict) for entry_dict in entry_dicts]
+        entries = [
+            Entry(**entry_dict | {"metrics": compact_metrics(entry_dict["metrics"])})
+            for entry_dict in entry_dicts
+        ]
         return Diary(entries=entries, **dump)
 
     def save(self, file: TextIO) -> None:
@@ -1,77 +1,434 @@
+from collections import Counter, defaultdict
+from concurrent.futures import Future
 from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Sequence
+import atexit
+import heapq
+import math
+import queue
+import random
 import sqlite3
+import sys
+import threading
+import time
 
-from .core import Diary, Entry
+from .cache import LRUCache
+from .core import EMPTY_METRICS, Diary, Entry
+from .migrations import migrate
+from .nlp import tokenize
+
+# Applied to every new connection. WAL lets readers carry on while a request
+# writes, and with WAL synchronous=NORMAL is still safe against corruption.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative values are in KiB
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    # milliseconds to wait for another connection's write lock before giving up
+    "busy_timeout": 5000,
+}
+STATEMENT_CACHE_SIZE = 256
+# How long the writer waits to gather more writes into a transaction, in seconds,
+# the most it puts in one, and how often it retries a transaction that's locked out
+GROUP_COMMIT_DELAY = 0.002
+GROUP_COMMIT_SIZE = 256
+GROUP_COMMIT_RETRIES = 5
+GROUP_COMMIT_BACKOFF = 0.01
+DIARY_CACHE_ENTRIES = 100_000
+# Idle connections kept per database, about as many as requests served at once
+POOL_SIZE = 16
+# Okapi BM25 parameters, how quickly repeats of a term saturate and how much
+# an entry's length counts against it
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class ConnectionPool:
+    """Long-lived sqlite connections, checked out for a call and returned after, so
+    the cost of opening a connection, applying pragmas and migrating the schema is
+    only paid when every idle connection to an address is in use. This doesn't depend
+    on threads being reused, flask run starts a thread per request.
+    At most max_idle connections per address are kept, more are opened under load
+    and closed when they're returned. A thread which already has a connection to an
+    address gets the same one, so nested calls share it rather than waiting on each
+    other's transactions.
+    """
+
+    def __init__(self, max_idle: int = POOL_SIZE):
+        self.max_idle = max_idle
+        self.opened = 0
+        self._lock = threading.Lock()
+        self._initialised: set[str] = set()
+        self._idle: dict[str, queue.Queue] = {}
+        # Bumped by close, connections checked out before then are closed on return
+        self._generation = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def connection(self, address: str) -> Iterator[sqlite3.Connection]:
+        """Check out a connection to address, opening one if none are idle, and
+        return it to the pool after the block."""
+        held = self._local.__dict__.setdefault("held", {})
+        if address in held:
+            yield held[address]
+            return
+        with self._lock:
+            generation = self._generation
+            idle = self._idle.setdefault(address, queue.Queue(self.max_idle))
+        try:
+            con = idle.get_nowait()
+        except queue.Empty:
+            con = self._open(address)
+        held[address] = con
+        try:
+            yield con
+        finally:
+            del held[address]
+            self._release(address, con, generation)
+
+    def _open(self, address: str) -> sqlite3.Connection:
+        con = sqlite3.connect(
+            address,
+            cached_statements=STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+        )
+        for pragma, value in PRAGMAS.items():
+            con.execute(f"PRAGMA {pragma}={value}")
+        with self._lock:
+            if address not in self._initialised:
+                migrate(con)
+                self._initialised.add(address)
+            self.opened += 1
+        return con
+
+    def _release(self, address: str, con: sqlite3.Connection, generation: int) -> None:
+        if con.in_transaction:
+            con.rollback()
+        with self._lock:
+            if generation == self._generation:
+                try:
+                    self._idle[address].put_nowait(con)
+                    return
+                except queue.Full:
+                    pass
+        con.close()
+
+    def close(self) -> None:
+        """Close every idle connection, and those in use once they're returned."""
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, {}
+            self._initialised.clear()
+        for connections in idle.values():
+            while not connections.empty():
+                connections.get_nowait().close()
+
+
+pool = ConnectionPool()
+atexit.register(pool.close)
+
+_STOP = object()
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    # the low byte is the primary result code, extended codes add detail above it
+    return (error.sqlite_errorcode & 0xFF) in (
+        sqlite3.SQLITE_BUSY,
+        sqlite3.SQLITE_LOCKED,
+    )
+
+
+class GroupCommitWriter:
+    """A thread which does the writes of many callers in a single transaction, so
+    concurrent writers don't lock each other out and the cost of syncing to disk is
+    shared. Writes arriving within delay seconds of each other, or while the last
+    transaction was committing, go in together, up to max_batch of them.
+    Each write runs in its own savepoint, so one that fails is rolled back and
+    raises in its caller without affecting the rest. A transaction locked out by
+    another process is retried, backing off exponentially.
+    The thread starts on the first write, and finishes what's queued at exit."""
+
+    def __init__(
+        self,
+        delay: float = GROUP_COMMIT_DELAY,
+        max_batch: int = GROUP_COMMIT_SIZE,
+        retries: int = GROUP_COMMIT_RETRIES,
+        backoff: float = GROUP_COMMIT_BACKOFF,
+    ):
+        self.delay = delay
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.transactions = 0
+        self.writes = 0
+        self.retried = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def write(self, address: str, work: Callable[[sqlite3.Cursor], Any]) -> Any:
+        """Run work with a cursor on the writer's connection to address, and return
+        its result once the transaction it's part of has committed. The work may be
+        run again if the transaction has to be retried, so it should only write."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("GroupCommitWriter is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="group-commit", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+            self._queue.put((address, work, future))
+        return future.result()
+
+    def close(self) -> None:
+        """Commit what's queued and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            if self._thread is None:
+                return
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.delay
+            while len(batch) < self.max_batch and batch[-1] is not _STOP:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            by_address = defaultdict(list)
+            for job in batch:
+                if job is not _STOP:
+                    by_address[job[0]].append(job)
+            for address, jobs in by_address.items():
+                try:
+                    self._commit(address, jobs)
+                except Exception as error:
+                    for _, _, future in jobs:
+                        if not future.done():
+                            future.set_exception(error)
+            if batch[-1] is _STOP:
+                return
+
+    def _commit(self, address: str, jobs: list) -> None:
+        """Run jobs in one transaction, retrying it while the database is busy."""
+        with pool.connection(address) as con:
+            # Callers are told their write is done once it's on disk, which with one
+            # sync per transaction rather than per write is affordable
+            con.execute("PRAGMA synchronous=FULL")
+            try:
+                self._run_jobs(con, jobs)
+            finally:
+                # the connection goes back to the pool for everyone else
+                con.execute(f"PRAGMA synchronous={PRAGMAS['synchronous']}")
+
+    def _run_jobs(self, con: sqlite3.Connection, jobs: list) -> None:
+        for attempt in range(self.retries + 1):
+            results = []
+            try:
+                con.execute("BEGIN IMMEDIATE")
+                cur = con.cursor()
+                for _, work, _ in jobs:
+                    cur.execute("SAVEPOINT write")
+                    try:
+                        results.append((work(cur), None))
+                    except sqlite3.OperationalError as error:
+                        if _is_busy(error):
+                            raise
+                        cur.execute("ROLLBACK TO write")
+                        results.append((None, error))
+                    except Exception as error:
+                        cur.execute("ROLLBACK TO write")
+                        results.append((None, error))
+                    cur.execute("RELEASE write")
+                cur.close()
+                con.commit()
+                break
+            except sqlite3.OperationalError as error:
+                if con.in_transaction:
+                    con.rollback()
+                if not _is_busy(error) or attempt == self.retries:
+                    raise
+                self.retried += 1
+                time.sleep(self.backoff * 2**attempt * random.uniform(0.5, 1.5))
+        self.transactions += 1
+        self.writes += len(jobs)
+        for (_, _, future), (result, error) in zip(jobs, results):
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+
+writer = GroupCommitWriter()
+
+# Diaries returned by load_diary, keyed by (address, username) and bounded by the
+# total number of entries held. The functions in this module which write keep it up
+# to date, anything writing to the DB by other means must invalidate it. As the same
+# object is handed to every reader, diaries from load_diary shouldn't be modified.
+diary_cache = LRUCache(DIARY_CACHE_ENTRIES, weigh=lambda diary: len(diary.entries) + 1)
 
 
 @contextmanager
 def db_cursor(address: str):
     """Convenience wrapper for DB functions.
-    If the DB doesn't exist initialise it."""
-    try:
-        con = sqlite3.connect(f"file:{address}?mode=rw", uri=True)
-    except sqlite3.OperationalError:
-        with sqlite3.connect(address) as con:
-            con.execute(
-                """CREATE TABLE diary
-                        (uuid TEXT PRIMARY KEY, username TEXT UNIQUE, name TEXT)"""
-            )
-            con.execute(
-                """CREATE TABLE entry
-                        (uuid TEXT PRIMARY KEY, diary TEXT, timestamp TEXT, text TEXT)"""
-            )
-            con.execute(
-                """CREATE TABLE metric
-                        (entry TEXT, metric TEXT, value REAL)"""
-            )
-    try:
-        with con:
-            yield con.cursor()
-    finally:
-        con.close()
+    Checks out a pooled connection, creating or migrating the DB if needed.
+    Everything done with the cursor is committed as one transaction."""
+    with pool.connection(address) as con, con:
+        cur = con.cursor()
+        try:
+            yield cur
+        finally:
+            cur.close()
 
 
 def drop_db(adress: str):
     with db_cursor(adress) as cur:
+        # Rollups first, so deleting the metrics has none to recompute
+        cur.execute("DELETE FROM metric_rollup")
+        cur.execute("DELETE FROM metric")
         cur.execute("DELETE FROM diary")
         cur.execute("DELETE FROM entry")
-        cur.execute("DELETE FROM metric")
+        cur.execute("DELETE FROM metric_name")
+        cur.execute("DELETE FROM posting")
+        cur.execute("DELETE FROM diary_terms")
+    diary_cache.invalidate(lambda key, diary: key[0] == adress)
 
 
 def create_diary(address: str, diary: Diary, username: str) -> None:
     """Save a diary to the database"""
+    terms = _term_counts([entry.text for entry in diary.entries])
     with db_cursor(address) as cur:
         cur.execute(
-            "INSERT INTO diary VALUES (?,?,?)", (diary.uuid, username, diary.name)
+            "INSERT INTO diary (uuid, username, name) VALUES (?,?,?)",
+            (diary.uuid, username, diary.name),
         )
         cur.executemany(
-            "INSERT INTO entry VALUES (?, ?, ?, ?)",
+            "INSERT INTO entry (uuid, diary, timestamp, text) VALUES (?, ?, ?, ?)",
             [
                 (entry.uuid, diary.uuid, entry.timestamp, entry.text)
                 for entry in diary.entries
             ],
         )
-        cur.executemany(
-            "INSERT INTO metric VALUES (?, ?, ?)",
+        insert_metrics(
+            cur,
             [
                 (entry.uuid, metric, value)
                 for entry in diary.entries
                 for metric, value in entry.metrics.items()
             ],
         )
+        if terms is not None:
+            ids = dict(
+                cur.execute("SELECT uuid, id FROM entry WHERE diary=?", (diary.uuid,))
+            )
+            _add_postings(
+                cur,
+                diary.uuid,
+                [
+                    (ids[entry.uuid], counts)
+                    for entry, counts in zip(diary.entries, terms)
+                ],
+            )
+    diary_cache.invalidate(lambda key, _: key == (address, username))
 
 
 def create_entry(address: str, diary_uuid: str, entry: Entry) -> None:
-    """Create a new Entry record in the database"""
-    with db_cursor(address) as cur:
+    """Create a new Entry record in the database.
+    It's written by the group commit writer, along with any other entries being
+    created at the same time, and this returns once it's committed.
+    Its terms are counted first, so the transaction isn't held up by NLTK."""
+    terms = _term_counts([entry.text])
+
+    def insert(cur: sqlite3.Cursor) -> None:
         cur.execute(
-            "INSERT INTO entry VALUES (?, ?, ?, ?)",
+            "INSERT INTO entry (uuid, diary, timestamp, text) VALUES (?, ?, ?, ?)",
             (entry.uuid, diary_uuid, entry.timestamp, entry.text),
         )
-        cur.executemany(
-            "INSERT INTO metric VALUES (?, ?, ?)",
+        entry_id = cur.lastrowid
+        insert_metrics(
+            cur,
             [(entry.uuid, metric, value) for metric, value in entry.metrics.items()],
         )
+        if terms is not None:
+            _add_postings(cur, diary_uuid, [(entry_id, terms[0])])
+
+    writer.write(address, insert)
+    diary_cache.invalidate(
+        lambda key, diary: key[0] == address and diary.uuid == diary_uuid
+    )
+
+
+def insert_metrics(cur: sqlite3.Cursor, metrics: list[tuple[str, str, float]]) -> None:
+    """Save (entry uuid, metric name, value) rows, adding any new names to metric_name.
+    Rows for entries which don't exist, or which already have the metric, e.g. one
+    derived by both DerivedMetricWriter and its backfill, are skipped."""
+    cur.executemany(
+        "INSERT OR IGNORE INTO metric_name (name) VALUES (?)",
+        [(name,) for name in {name for _, name, _ in metrics}],
+    )
+    cur.executemany(
+        """INSERT OR IGNORE INTO metric (entry, metric, value)
+        SELECT entry.id, metric_name.id, ? FROM entry, metric_name
+        WHERE entry.uuid=? AND metric_name.name=?""",
+        [(value, entry_uuid, name) for entry_uuid, name, value in metrics],
+    )
+
+
+def _term_counts(texts: list[str]) -> Optional[list[Counter]]:
+    """The stemmed terms of each text, counted with nlp.tokenize, or None if the NLTK
+    data isn't available. Entries saved without their terms are indexed by
+    ranked_search instead."""
+    try:
+        return [Counter(tokenize(text)) for text in texts]
+    except LookupError:
+        return None
+
+
+def _add_postings(
+    cur: sqlite3.Cursor, diary_uuid: str, entries: list[tuple[int, Counter]]
+) -> None:
+    """Add (entry id, term counts) pairs of a diary's entries to the term index."""
+    postings = [
+        (diary_uuid, term, entry_id, frequency)
+        for entry_id, terms in entries
+        for term, frequency in terms.items()
+    ]
+    term_counts = [(sum(terms.values()), entry_id) for entry_id, terms in entries]
+    if not term_counts:
+        return
+    cur.executemany("INSERT INTO posting VALUES (?, ?, ?, ?)", postings)
+    cur.executemany("UPDATE entry SET term_count=? WHERE id=?", term_counts)
+    cur.execute(
+        """INSERT INTO diary_terms VALUES (?, ?, ?) ON CONFLICT (diary) DO UPDATE
+        SET entries=entries+excluded.entries, terms=terms+excluded.terms""",
+        (diary_uuid, len(term_counts), sum(count for count, _ in term_counts)),
+    )
+
+
+def _index_terms(cur: sqlite3.Cursor, diary_uuid: str) -> None:
+    """Add the entries of a diary which aren't in the term index yet to it, e.g. those
+    from before the index existed, counting the stemmed terms of each."""
+    rows = cur.execute(
+        "SELECT id, text FROM entry WHERE diary=? AND term_count IS NULL",
+        (diary_uuid,),
+    ).fetchall()
+    _add_postings(
+        cur,
+        diary_uuid,
+        [(entry_id, Counter(tokenize(text))) for entry_id, text in rows],
+    )
 
 
 def update_diary(address: str, diary: Diary) -> None:
@@ -79,34 +436,257 @@ def update_diary(address: str, diary: Diary) -> None:
     create_entry(address, diary.uuid, diary.entries[-1])
 
 
+def _find_diary(cur: sqlite3.Cursor, address: str, username: str) -> tuple[str, str]:
+    """Look up the uuid and name of the diary belonging to a user"""
+    cur.execute(
+        "SELECT uuid, name FROM diary WHERE username=:username", {"username": username}
+    )
+    rows = cur.fetchall()
+    if len(rows) == 0:
+        raise LookupError(f"{username} not found in db {address}")
+    elif len(rows) > 1:
+        sqlite3.IntegrityError(f"{username} found {len(rows)} times in db {address}")
+    return rows[0]
+
+
+# Joined to the entry table to load the name and value of each of its metrics
+_METRICS = """LEFT JOIN metric ON metric.entry=entry.id
+LEFT JOIN metric_name ON metric_name.id=metric.metric"""
+
+
+def _hydrate(rows) -> list[Entry]:
+    """Build entries from (uuid, timestamp, text, metric name, value) rows,
+    as produced by joining entry to _METRICS, keeping the order of first appearance."""
+    entries: dict[str, Entry] = {}
+    for entry_uuid, timestamp, text, key, value in rows:
+        try:
+            entry = entries[entry_uuid]
+        except KeyError:
+            entry = Entry(
+                timestamp=timestamp, text=text, uuid=entry_uuid, metrics=EMPTY_METRICS
+            )
+            entries[entry_uuid] = entry
+        if key:
+            if entry.metrics is EMPTY_METRICS:
+                entry.metrics = {}
+            entry.metrics[sys.intern(key)] = value
+    return list(entries.values())
+
+
 def load_diary(address: str, username: str) -> Diary:
-    """Load a Diary from the database given a username"""
+    """Load a Diary from the database given a username, or from the cache if it has
+    been loaded recently"""
+    diary = diary_cache.get((address, username))
+    if diary is not None:
+        return diary
+    generation = diary_cache.generation
     with db_cursor(address) as cur:
-        cur.execute(
-            "SELECT * FROM diary WHERE username=:username", {"username": username}
+        uuid, name = _find_diary(cur, address, username)
+        entries = _hydrate(
+            cur.execute(
+                f"""SELECT entry.uuid, timestamp, text, metric_name.name, value
+                FROM entry {_METRICS} WHERE diary=? ORDER BY timestamp""",
+                (uuid,),
+            )
         )
-        rows = cur.fetchall()
-        if len(rows) == 0:
-            raise LookupError(f"{username} not found in db {address}")
-        elif len(rows) > 1:
-            sqlite3.IntegrityError(
-                f"{username} found {len(rows)} times in db {address}"
+    diary = Diary(name, entries, uuid)
+    diary_cache.put((address, username), diary, generation)
+    return diary
+
+
+def find_diary(address: str, username: str) -> tuple[str, str]:
+    """Look up the uuid and name of a user's diary without loading any entries"""
+    with db_cursor(address) as cur:
+        return _find_diary(cur, address, username)
+
+
+def iter_entries(
+    address: str,
+    username: str,
+    after_timestamp: Optional[str] = None,
+    after_uuid: Optional[str] = None,
+    limit: Optional[int] = None,
+    batch_size: int = 100,
+) -> Iterator[Entry]:
+    """Stream entries from a user's diary in (timestamp, uuid) order, at most
+    batch_size at a time, so memory use doesn't grow with the size of the diary.
+    Starts after the entry given by after_timestamp and after_uuid, or after
+    after_timestamp alone, and stops after limit entries if given."""
+    uuid, _ = find_diary(address, username)
+    while limit is None or limit > 0:
+        if after_timestamp is None:
+            where, params = "", ()
+        elif after_uuid is None:
+            where, params = "AND timestamp > ?", (after_timestamp,)
+        else:
+            where, params = "AND (timestamp, uuid) > (?, ?)", (
+                after_timestamp,
+                after_uuid,
             )
+        size = batch_size if limit is None else min(batch_size, limit)
+        with db_cursor(address) as cur:
+            entries = _hydrate(
+                cur.execute(
+                    f"""SELECT entry.uuid, entry.timestamp, entry.text,
+                        metric_name.name, value
+                    FROM (
+                        SELECT id, uuid, timestamp, text FROM entry WHERE diary=? {where}
+                        ORDER BY timestamp, uuid LIMIT ?
+                    ) AS entry {_METRICS}
+                    ORDER BY entry.timestamp, entry.uuid""",
+                    (uuid, *params, size),
+                )
+            )
+        yield from entries
+        if len(entries) < size:
+            return
+        after_timestamp, after_uuid = entries[-1].timestamp, entries[-1].uuid
+        if limit is not None:
+            limit -= len(entries)
 
-        uuid, _, name = rows[0]
-        entries: dict[str, Entry] = {}
-        for row in cur.execute(
-            "SELECT * FROM entry LEFT JOIN metric ON entry.uuid=metric.entry WHERE diary=? ORDER BY timestamp",
-            (uuid,),
-        ):
-            entry_uuid, _, timestamp, text, _, key, value = row
-            try:
-                entry = entries[entry_uuid]
-            except KeyError:
-                entry = Entry(
-                    timestamp=timestamp, text=text, uuid=entry_uuid, metrics={}
+
+def recent_entries(address: str, diary_uuid: str, limit: int) -> list[Entry]:
+    """The latest entries in a diary, at most limit of them, in time order"""
+    with db_cursor(address) as cur:
+        return _hydrate(
+            cur.execute(
+                f"""SELECT entry.uuid, entry.timestamp, entry.text,
+                    metric_name.name, value
+                FROM (
+                    SELECT id, uuid, timestamp, text FROM entry WHERE diary=?
+                    ORDER BY timestamp DESC, uuid DESC LIMIT ?
+                ) AS entry {_METRICS}
+                ORDER BY entry.timestamp, entry.uuid""",
+                (diary_uuid, limit),
+            )
+        )
+
+
+def latest_entry(address: str, diary_uuid: str) -> Optional[tuple[str, str]]:
+    """The timestamp and uuid of the latest entry in a diary, or None if it's empty"""
+    with db_cursor(address) as cur:
+        return cur.execute(
+            """SELECT timestamp, uuid FROM entry WHERE diary=?
+            ORDER BY timestamp DESC, uuid DESC LIMIT 1""",
+            (diary_uuid,),
+        ).fetchone()
+
+
+def metric_version(address: str, diary_uuid: str) -> int:
+    """A number which changes whenever a metric in the diary is written or deleted"""
+    with db_cursor(address) as cur:
+        row = cur.execute(
+            "SELECT metric_version FROM diary WHERE uuid=?", (diary_uuid,)
+        ).fetchone()
+    return row[0] if row else 0
+
+
+def metric_names(address: str, diary_uuid: str) -> list[str]:
+    """The names of the metrics recorded in a diary, in alphabetical order"""
+    with db_cursor(address) as cur:
+        return [
+            name
+            for name, in cur.execute(
+                """SELECT DISTINCT name FROM entry
+                JOIN metric ON metric.entry=entry.id
+                JOIN metric_name ON metric_name.id=metric.metric
+                WHERE diary=? ORDER BY name""",
+                (diary_uuid,),
+            )
+        ]
+
+
+def select_entries(
+    address: str, username: str, where: str = "", params: Sequence = ()
+) -> list[Entry]:
+    """Load the entries from a user's diary that satisfy an SQL condition, in time order.
+    The condition is over the entry table and may use ? placeholders filled from params,
+    see search.EntryQuery for building them."""
+    with db_cursor(address) as cur:
+        uuid, _ = _find_diary(cur, address, username)
+        return _hydrate(
+            cur.execute(
+                f"""SELECT entry.uuid, timestamp, text, metric_name.name, value
+                FROM entry {_METRICS}
+                WHERE diary=? {"AND " + where if where else ""} ORDER BY timestamp""",
+                (uuid, *params),
+            )
+        )
+
+
+def fts_phrase(search_term: str) -> str:
+    """Quote a search term as a single FTS5 phrase"""
+    return '"' + search_term.replace('"', '""') + '"'
+
+
+def text_condition(search_term: str) -> tuple[str, list]:
+    """An SQL condition over the entry table, and its parameters, for entries where
+    the search term is a substring of the text, the database equivalent of
+    search.strict_search. Terms of at least three characters are answered by the
+    trigram full-text index."""
+    if len(search_term) >= 3:
+        return (
+            "entry.id IN (SELECT rowid FROM entry_fts WHERE entry_fts MATCH ?)",
+            [fts_phrase(search_term)],
+        )
+    # Too short to make a trigram, and short terms match most entries anyway.
+    return "instr(entry.text, ?)", [search_term]
+
+
+def ranked_search(address: str, username: str, query: str, k: int = 10) -> list[Entry]:
+    """The k entries from a user's diary most relevant to a query, most relevant first.
+    The query and entries are compared by their stemmed terms, without stopwords, so
+    "walked" finds "walking", and entries are scored by Okapi BM25.
+    Only the postings of the query's terms are read, not the text of every entry."""
+    terms = set(tokenize(query))
+    if not terms or k <= 0:
+        return []
+    with db_cursor(address) as cur:
+        uuid, _ = _find_diary(cur, address, username)
+        _index_terms(cur, uuid)
+        entry_count, term_count = cur.execute(
+            "SELECT entries, terms FROM diary_terms WHERE diary=?", (uuid,)
+        ).fetchone() or (0, 0)
+        if not entry_count:
+            return []
+        average_length = term_count / entry_count
+        scores: dict[int, float] = {}
+        for term in terms:
+            postings = cur.execute(
+                """SELECT posting.entry, frequency, term_count
+                FROM posting JOIN entry ON entry.id=posting.entry
+                WHERE posting.diary=? AND term=?""",
+                (uuid, term),
+            ).fetchall()
+            idf = math.log(
+                (entry_count - len(postings) + 0.5) / (len(postings) + 0.5) + 1
+            )
+            for entry_id, frequency, length in postings:
+                scores[entry_id] = scores.get(entry_id, 0.0) + idf * (
+                    frequency
+                    * (BM25_K1 + 1)
+                    / (
+                        frequency
+                        + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                    )
                 )
-                entries[entry_uuid] = entry
-            if key:
-                entry.metrics[key] = value
-    return Diary(name, list(entries.values()), uuid)
+        # ties go to the earlier entry
+        top = heapq.nlargest(
+            k, scores, key=lambda entry_id: (scores[entry_id], -entry_id)
+        )
+        if not top:
+            return []
+        ranks = ", ".join("(?, ?)" for _ in top)
+        return _hydrate(
+            cur.execute(
+                f"""WITH ranked (id, rank) AS (VALUES {ranks})
+                SELECT entry.uuid, timestamp, text, metric_name.name, value
+                FROM ranked JOIN entry ON entry.id=ranked.id {_METRICS}
+                ORDER BY rank""",
+                [
+                    value
+                    for rank, entry_id in enumerate(top)
+                    for value in (entry_id, rank)
+                ],
+            )
+        )
@@ -0,0 +1,207 @@
+"""Metrics derived from the text of entries, e.g. sentiment, stored alongside the
+metrics written in the text so they're read rather than recomputed.
+New entries are analysed in the background, so adding an entry doesn't wait for NLTK.
+"""
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+import atexit
+import logging
+import queue
+import threading
+
+from .core import Entry
+from .db import db_cursor, diary_cache, insert_metrics
+from .nlp import BATCH_CHUNK_SIZE, stats_batch
+
+logger = logging.getLogger(__name__)
+
+# Derived metrics are stored under this prefix, which can't clash with a #tag
+DERIVED_PREFIX = "nlp."
+QUEUE_SIZE = 1024
+# Small enough that stats_batch analyses a batch in the writer's own thread
+BATCH_SIZE = BATCH_CHUNK_SIZE
+
+# Takes a list of texts and returns the metrics of each, in the same order
+Analyse = Callable[[list[str]], list[dict[str, float]]]
+
+_STOP = object()
+
+
+def _metric_rows(
+    results: Iterable[tuple[str, Optional[dict[str, float]]]]
+) -> list[tuple[str, str, float]]:
+    """insert_metrics rows for (entry uuid, metrics) pairs, skipping unanalysed ones"""
+    return [
+        (entry_uuid, DERIVED_PREFIX + metric, value)
+        for entry_uuid, metrics in results
+        if metrics is not None
+        for metric, value in metrics.items()
+    ]
+
+
+class DerivedMetricWriter:
+    """A thread which analyses entries after they're saved, and writes the results to
+    the metric table as DERIVED_PREFIX + name, e.g. nlp.compound, a batch at a time.
+    analyse takes a list of texts and returns a dict of metrics for each.
+    At most max_queued entries wait, after that submit blocks until there's room.
+    The thread starts on the first submit, and entries still queued at exit are
+    written before the interpreter stops."""
+
+    def __init__(
+        self,
+        analyse: Analyse = stats_batch,
+        max_queued: int = QUEUE_SIZE,
+        batch_size: int = BATCH_SIZE,
+    ):
+        self.analyse = analyse
+        self.batch_size = batch_size
+        self.written = 0
+        self.failed = 0
+        self._queue: queue.Queue = queue.Queue(max_queued)
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._lock = threading.Lock()
+        # (address, entry uuid) of entries backfill couldn't analyse
+        self._unanalysable: set[tuple[str, str]] = set()
+
+    def submit(
+        self,
+        address: str,
+        diary_uuid: str,
+        entry: Entry,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """Queue an entry, which should already be saved, to be analysed.
+        Raises queue.Full if there's still no room after timeout seconds."""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("DerivedMetricWriter is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="derived-metrics", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put((address, diary_uuid, entry.uuid, entry.text), timeout=timeout)
+
+    def drain(self) -> None:
+        """Wait until every entry queued so far has been written."""
+        self._queue.join()
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write what's queued, then stop the thread, waiting at most timeout seconds."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def backfill(
+        self, address: str, diary_uuid: str, metric: str, analyse: Analyse
+    ) -> int:
+        """Analyse, in this thread, the entries of a diary without DERIVED_PREFIX +
+        metric, e.g. those from create_diary or saved while DERIVE_METRICS was off,
+        and write their results. analyse only needs to give that metric, e.g.
+        sentiment_batch for compound. Entries it fails on are remembered and not
+        retried. Returns how many entries were written."""
+        with db_cursor(address) as cur:
+            rows = cur.execute(
+                """SELECT uuid, text FROM entry WHERE diary=? AND NOT EXISTS (
+                    SELECT 1 FROM metric WHERE metric.entry=entry.id
+                    AND metric.metric=(SELECT id FROM metric_name WHERE name=?))
+                ORDER BY timestamp""",
+                (diary_uuid, DERIVED_PREFIX + metric),
+            ).fetchall()
+        rows = [row for row in rows if (address, row[0]) not in self._unanalysable]
+        if not rows:
+            return 0
+        results = self._analyse([text for _, text in rows], analyse)
+        self._unanalysable.update(
+            (address, uuid)
+            for (uuid, _), metrics in zip(rows, results)
+            if metrics is None
+        )
+        with db_cursor(address) as cur:
+            insert_metrics(
+                cur,
+                _metric_rows(
+                    (uuid, metrics) for (uuid, _), metrics in zip(rows, results)
+                ),
+            )
+        diary_cache.invalidate(
+            lambda key, diary: key[0] == address and diary.uuid == diary_uuid
+        )
+        written = sum(metrics is not None for metrics in results)
+        self.written += written
+        return written
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not _STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            jobs = [job for job in batch if job is not _STOP]
+            try:
+                if jobs:
+                    self._write(jobs)
+            except Exception:
+                self.failed += len(jobs)
+                logger.exception("Couldn't derive metrics for %d entries", len(jobs))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is _STOP:
+                return
+
+    def _analyse(
+        self, texts: list[str], analyse: Optional[Analyse] = None
+    ) -> list[Optional[dict[str, float]]]:
+        """The metrics of each text, or None for a text which couldn't be analysed.
+        If a batch fails its texts are analysed one by one, so one bad text doesn't
+        lose the metrics of the rest. analyse defaults to the writer's."""
+        analyse = analyse or self.analyse
+        try:
+            return analyse(texts)
+        except Exception:
+            if len(texts) == 1:
+                self.failed += 1
+                logger.exception("Couldn't derive metrics for an entry")
+                return [None]
+        return [metrics for text in texts for metrics in self._analyse([text], analyse)]
+
+    def _write(self, jobs: list[tuple[str, str, str, str]]) -> None:
+        results = self._analyse([text for *_, text in jobs])
+        by_address: dict[str, list] = defaultdict(list)
+        for (address, diary_uuid, entry_uuid, _), metrics in zip(jobs, results):
+            if metrics is not None:
+                by_address[address].append((diary_uuid, entry_uuid, metrics))
+        for address, rows in by_address.items():
+            with db_cursor(address) as cur:
+                uuids = [entry_uuid for _, entry_uuid, _ in rows]
+                # Entries removed while queued, e.g. by drop_db, are skipped
+                existing = {
+                    uuid
+                    for uuid, in cur.execute(
+                        f"""SELECT uuid FROM entry
+                        WHERE uuid IN ({", ".join("?" for _ in uuids)})""",
+                        uuids,
+                    )
+                }
+                insert_metrics(
+                    cur,
+                    _metric_rows(
+                        (entry_uuid, metrics)
+                        for _, entry_uuid, metrics in rows
+                        if entry_uuid in existing
+                    ),
+                )
+            diaries = {diary_uuid for diary_uuid, _, _ in rows}
+            diary_cache.invalidate(
+                lambda key, diary: key[0] == address and diary.uuid in diaries
+            )
+            self.written += len(existing)
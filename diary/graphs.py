@@ -0,0 +1,220 @@
+"""Rendering graphs to PNG, with a cache of rendered images.
+Graphs are keyed by a hash of everything drawn, so an unchanged graph is never
+rendered twice and a changed one can't be served stale.
+numpy and matplotlib are only imported when a graph is wanted.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from typing import Any, Optional
+import hashlib
+import os
+import threading
+
+from .cache import LRUCache
+from .workers import WorkerPool
+
+GRAPH_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def _hash_values(digest, values) -> None:
+    import numpy as np
+
+    array = np.asarray(values)
+    if array.dtype.hasobject:
+        digest.update(repr(array.tolist()).encode())
+    else:
+        digest.update(f"{array.dtype.str}{array.shape}".encode())
+        digest.update(np.ascontiguousarray(array).tobytes())
+
+
+def graph_key(name: str, X, Y, options: dict[str, Any]) -> str:
+    """A hash of a graph's name, data and figure options."""
+    digest = hashlib.sha256()
+    digest.update(repr((name, sorted(options.items()))).encode())
+    _hash_values(digest, X)
+    _hash_values(digest, Y)
+    return digest.hexdigest()
+
+
+def render_png(X, Y, **figure_options) -> bytes:
+    """Plot Y against X, figure_options are passed to matplotlib's Figure,
+    e.g. figsize or dpi."""
+    from io import BytesIO
+
+    from matplotlib.figure import Figure
+
+    fig = Figure(**figure_options)
+    ax = fig.subplots()
+    ax.plot(X, Y)
+    buf = BytesIO()
+    fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def _init_worker() -> None:
+    """Import matplotlib and draw a graph, so a worker's first real graph is quick."""
+    render_png([0, 1], [0, 1])
+
+
+workers = WorkerPool(_init_worker)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The process pool for rendering, see WorkerPool."""
+    return workers.get()
+
+
+class GraphCache:
+    """Rendered PNGs, held in memory up to max_bytes, least recently used first out.
+    Given a directory they're also written to disk, up to max_disk_bytes, so they
+    survive restarts and can be shared between processes.
+    Counts hits in memory and on disk, and renders, so the hit rate can be monitored.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = GRAPH_CACHE_BYTES,
+        directory: Optional[str] = None,
+        max_disk_bytes: Optional[int] = None,
+    ):
+        self.memory = LRUCache(max_bytes, weigh=len)
+        self.directory = directory
+        self.max_disk_bytes = (
+            8 * max_bytes if max_disk_bytes is None else max_disk_bytes
+        )
+        self.disk_hits = 0
+        self.renders = 0
+        self._lock = threading.Lock()
+        # renders on the process pool which haven't finished, by key
+        self._rendering: dict[str, Future] = {}
+        self._disk_bytes = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def png(self, name: str, X, Y, **figure_options) -> bytes:
+        """The graph of Y against X as PNG bytes, rendered only if it isn't cached."""
+        key = graph_key(name, X, Y, figure_options)
+        png = self._cached(key)
+        if png is None and key in self._rendering:
+            try:
+                png = self._rendering[key].result()
+            except Exception:
+                png = None
+        if png is None:
+            png = render_png(X, Y, **figure_options)
+            with self._lock:
+                self.renders += 1
+            self._write(key, png)
+            self.memory.put(key, png)
+        return png
+
+    def render_all(
+        self,
+        graphs: dict[str, tuple],
+        timeout: Optional[float] = None,
+        **figure_options,
+    ) -> dict[str, bytes]:
+        """Get many graphs, given as {name: (X, Y)}, rendering those which aren't cached
+        in parallel on the process pool. Waits at most timeout seconds, and returns
+        the graphs ready by then, the rest are cached as they finish."""
+        ready: dict[str, bytes] = {}
+        pending: dict[Future, tuple[str, str]] = {}
+        for name, (X, Y) in graphs.items():
+            key = graph_key(name, X, Y, figure_options)
+            png = self._cached(key)
+            if png is not None:
+                ready[name] = png
+                continue
+            with self._lock:
+                future = self._rendering.get(key)
+                submitted = future is None
+                if submitted:
+                    future = workers.submit(render_png, X, Y, **figure_options)
+                    self._rendering[key] = future
+            if submitted:
+                future.add_done_callback(
+                    lambda future, key=key: self._rendered(key, future)
+                )
+            pending[future] = (name, key)
+        done, _ = wait(pending, timeout)
+        for future in done:
+            if future.exception() is None:
+                # the callback may not have run yet, so make sure it's cached now
+                name, key = pending[future]
+                ready[name] = future.result()
+                self.memory.put(key, ready[name])
+        return ready
+
+    def _cached(self, key: str) -> Optional[bytes]:
+        """A graph from memory, or from disk into memory, or None if it's not cached"""
+        png = self.memory.get(key)
+        if png is None:
+            png = self._read(key)
+            if png is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self.memory.put(key, png)
+        return png
+
+    def _rendered(self, key: str, future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            png = future.result()
+            with self._lock:
+                self.renders += 1
+            self._write(key, png)
+            self.memory.put(key, png)
+        with self._lock:
+            self._rendering.pop(key, None)
+
+    @property
+    def hit_rate(self) -> float:
+        """The fraction of graphs served without rendering."""
+        lookups = self.memory.hits + self.memory.misses
+        return (self.memory.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".png")  # type: ignore[arg-type]
+
+    def _disk_files(self) -> list[tuple[str, int, float]]:
+        """(path, size, last used) of every cached file, least recently used first"""
+        files = []
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.name.endswith(".png"):
+                stat = dir_entry.stat()
+                files.append((dir_entry.path, stat.st_size, stat.st_mtime))
+        return sorted(files, key=lambda file: file[2])
+
+    def _read(self, key: str) -> Optional[bytes]:
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                png = f.read()
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            return None
+        return png
+
+    def _write(self, key: str, png: bytes) -> None:
+        if self.directory is None or len(png) > self.max_disk_bytes:
+            return
+        path = self._path(key)
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(png)
+        os.replace(temporary, path)
+        with self._lock:
+            self._disk_bytes += len(png)
+            if self._disk_bytes <= self.max_disk_bytes:
+                return
+            # Another process may share the directory, so recount before evicting
+            files = self._disk_files()
+            self._disk_bytes = sum(size for _, size, _ in files)
+            for file_path, size, _ in files:
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+                try:
+                    os.remove(file_path)
+                except FileNotFoundError:
+                    pass
+                self._disk_bytes -= size
@@ -0,0 +1,357 @@
+"""Forward-only schema migrations.
+The schema version is stored in sqlite's user_version pragma, a database at version n
+has had the first n migrations applied. New migrations are only ever appended.
+"""
+
+from typing import Callable
+import sqlite3
+
+Migration = Callable[[sqlite3.Connection], None]
+
+MIGRATIONS: list[Migration] = []
+
+
+def migration(func: Migration) -> Migration:
+    """Register a migration, in order of definition."""
+    MIGRATIONS.append(func)
+    return func
+
+
+def schema_version(con: sqlite3.Connection) -> int:
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(con: sqlite3.Connection) -> int:
+    """Apply any outstanding migrations in a single transaction,
+    returns the resulting schema version."""
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        # Read inside the write lock, another process may have just migrated.
+        version = schema_version(con)
+        for func in MIGRATIONS[version:]:
+            func(con)
+        if version < len(MIGRATIONS):
+            con.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        con.commit()
+    except BaseException:
+        con.rollback()
+        raise
+    return len(MIGRATIONS)
+
+
+@migration
+def create_tables(con: sqlite3.Connection) -> None:
+    """The original schema, databases created before versioning already have it."""
+    con.execute(
+        """CREATE TABLE IF NOT EXISTS diary
+                (uuid TEXT PRIMARY KEY, username TEXT UNIQUE, name TEXT)"""
+    )
+    con.execute(
+        """CREATE TABLE IF NOT EXISTS entry
+                (uuid TEXT PRIMARY KEY, diary TEXT, timestamp TEXT, text TEXT)"""
+    )
+    con.execute(
+        """CREATE TABLE IF NOT EXISTS metric
+                (entry TEXT, metric TEXT, value REAL)"""
+    )
+
+
+@migration
+def add_indexes(con: sqlite3.Connection) -> None:
+    """Index the lookups made when loading and filtering a single diary."""
+    con.execute("CREATE INDEX IF NOT EXISTS entry_diary ON entry (diary, timestamp)")
+    con.execute("CREATE INDEX IF NOT EXISTS metric_entry ON metric (entry)")
+    con.execute("CREATE INDEX IF NOT EXISTS metric_value ON metric (metric, value)")
+
+
+@migration
+def add_full_text_search(con: sqlite3.Connection) -> None:
+    """Give entries an integer primary key, as the rowid of a table without one
+    can change on VACUUM, then index the text of entries by trigram.
+    Triggers keep the index in step with the entry table."""
+    con.execute(
+        """CREATE TABLE entry_new
+                (id INTEGER PRIMARY KEY, uuid TEXT UNIQUE NOT NULL,
+                diary TEXT, timestamp TEXT, text TEXT)"""
+    )
+    con.execute(
+        """INSERT INTO entry_new (uuid, diary, timestamp, text)
+        SELECT uuid, diary, timestamp, text FROM entry ORDER BY rowid"""
+    )
+    con.execute("DROP TABLE entry")
+    con.execute("ALTER TABLE entry_new RENAME TO entry")
+    con.execute("CREATE INDEX entry_diary ON entry (diary, timestamp)")
+
+    # case_sensitive keeps the semantics of search.strict_search
+    con.execute(
+        """CREATE VIRTUAL TABLE entry_fts USING fts5
+                (text, content='entry', content_rowid='id',
+                tokenize='trigram case_sensitive 1')"""
+    )
+    con.execute(
+        """CREATE TRIGGER entry_fts_insert AFTER INSERT ON entry BEGIN
+            INSERT INTO entry_fts (rowid, text) VALUES (new.id, new.text);
+        END"""
+    )
+    con.execute(
+        """CREATE TRIGGER entry_fts_delete AFTER DELETE ON entry BEGIN
+            INSERT INTO entry_fts (entry_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+        END"""
+    )
+    con.execute(
+        """CREATE TRIGGER entry_fts_update AFTER UPDATE OF text ON entry BEGIN
+            INSERT INTO entry_fts (entry_fts, rowid, text)
+            VALUES ('delete', old.id, old.text);
+            INSERT INTO entry_fts (rowid, text) VALUES (new.id, new.text);
+        END"""
+    )
+    con.execute("INSERT INTO entry_fts (entry_fts) VALUES ('rebuild')")
+
+
+@migration
+def add_uuid_to_diary_index(con: sqlite3.Connection) -> None:
+    """Entries are paged through by (timestamp, uuid), so break ties in the index."""
+    con.execute("DROP INDEX entry_diary")
+    con.execute("CREATE INDEX entry_diary ON entry (diary, timestamp, uuid)")
+
+
+@migration
+def add_analysis(con: sqlite3.Connection) -> None:
+    """Results of analysing the text of entries, e.g. sentiment, keyed by entry id and
+    the kind of analysis. The hash of the text analysed shows if they're out of date."""
+    con.execute(
+        """CREATE TABLE analysis
+                (entry INTEGER, kind TEXT, text_hash TEXT, key TEXT, value REAL)"""
+    )
+    con.execute("CREATE INDEX analysis_entry ON analysis (entry, kind)")
+    con.execute(
+        """CREATE TRIGGER analysis_delete AFTER DELETE ON entry BEGIN
+            DELETE FROM analysis WHERE entry=old.id;
+        END"""
+    )
+
+
+@migration
+def add_term_index(con: sqlite3.Connection) -> None:
+    """An inverted index of the stemmed terms in each entry, for ranked search.
+    entry.term_count is the number of terms indexed for an entry, or NULL if it hasn't
+    been indexed yet, and diary_terms totals them per diary. Entries are indexed when
+    they're written, entries from before this migration are indexed on first search.
+    Triggers remove an entry from the index when it's deleted or its text changes."""
+    con.execute("ALTER TABLE entry ADD COLUMN term_count INTEGER")
+    con.execute(
+        "CREATE INDEX entry_unindexed ON entry (diary) WHERE term_count IS NULL"
+    )
+    con.execute(
+        """CREATE TABLE posting
+                (diary TEXT, term TEXT, entry INTEGER, frequency INTEGER,
+                PRIMARY KEY (diary, term, entry)) WITHOUT ROWID"""
+    )
+    con.execute("CREATE INDEX posting_entry ON posting (entry)")
+    con.execute(
+        """CREATE TABLE diary_terms
+                (diary TEXT PRIMARY KEY, entries INTEGER, terms INTEGER)"""
+    )
+    con.execute(
+        """CREATE TRIGGER posting_delete AFTER DELETE ON entry
+        WHEN old.term_count IS NOT NULL BEGIN
+            DELETE FROM posting WHERE entry=old.id;
+            UPDATE diary_terms SET entries=entries-1, terms=terms-old.term_count
+            WHERE diary=old.diary;
+        END"""
+    )
+    con.execute(
+        """CREATE TRIGGER posting_update AFTER UPDATE OF text ON entry
+        WHEN old.term_count IS NOT NULL BEGIN
+            DELETE FROM posting WHERE entry=old.id;
+            UPDATE diary_terms SET entries=entries-1, terms=terms-old.term_count
+            WHERE diary=old.diary;
+            UPDATE entry SET term_count=NULL WHERE id=new.id;
+        END"""
+    )
+
+
+# sqlite date() expressions giving the start of the bucket containing a timestamp,
+# timestamps with an offset are bucketed in UTC. Weeks start on Monday.
+ROLLUP_BUCKETS = {
+    "day": "date({})",
+    "week": "date({}, 'weekday 0', '-6 days')",
+    "month": "date({}, 'start of month')",
+}
+
+
+def _rollup_buckets(timestamp: str, resolution: str = "resolution.name") -> str:
+    """A CASE expression giving the bucket of timestamp at resolution"""
+    cases = " ".join(
+        f"WHEN '{name}' THEN {bucket.format(timestamp)}"
+        for name, bucket in ROLLUP_BUCKETS.items()
+    )
+    return f"CASE {resolution} {cases} END"
+
+
+# date() would read a bare number as a julian day, so require an iso date
+_ISO_TIMESTAMP = "timestamp GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'"
+_ROLLED_UP = f"{_ISO_TIMESTAMP} AND bucket IS NOT NULL"
+_RESOLUTIONS = " UNION ALL ".join(f"SELECT '{name}' AS name" for name in ROLLUP_BUCKETS)
+
+
+@migration
+def add_metric_rollup(con: sqlite3.Connection) -> None:
+    """The count, total, minimum and maximum of each metric in each diary per day,
+    week and month, so long series can be graphed without reading every value.
+    A trigger adds each metric as it's inserted, metrics are never updated or
+    deleted other than by clearing the whole database. Values of entries whose
+    timestamp doesn't start with an iso date aren't rolled up."""
+    con.execute(
+        """CREATE TABLE metric_rollup
+                (diary TEXT, metric TEXT, resolution TEXT, bucket TEXT,
+                count INTEGER, total REAL, minimum REAL, maximum REAL,
+                PRIMARY KEY (diary, resolution, metric, bucket)) WITHOUT ROWID"""
+    )
+    con.execute(
+        f"""INSERT INTO metric_rollup
+        SELECT diary, metric, resolution.name, {_rollup_buckets("timestamp")} AS bucket,
+            count(*), sum(value), min(value), max(value)
+        FROM metric JOIN entry ON entry.uuid=metric.entry, ({_RESOLUTIONS}) AS resolution
+        WHERE {_ROLLED_UP}
+        GROUP BY diary, metric, resolution.name, bucket"""
+    )
+    con.execute(
+        f"""CREATE TRIGGER metric_rollup_insert AFTER INSERT ON metric BEGIN
+            INSERT INTO metric_rollup
+            SELECT diary, new.metric, resolution.name,
+                {_rollup_buckets("timestamp")} AS bucket,
+                1, new.value, new.value, new.value
+            FROM entry, ({_RESOLUTIONS}) AS resolution
+            WHERE entry.uuid=new.entry AND {_ROLLED_UP}
+            ON CONFLICT DO UPDATE SET count=count+1, total=total+excluded.total,
+                minimum=min(minimum, excluded.minimum),
+                maximum=max(maximum, excluded.maximum);
+        END"""
+    )
+
+
+@migration
+def add_metric_names(con: sqlite3.Connection) -> None:
+    """Store each metric name once, in metric_name, and refer to it and to entries by
+    integer id rather than repeating the name and entry uuid on every value.
+    Metrics are keyed by entry and clustered on it, so an entry's metrics are read
+    together and need no separate index. If an entry recorded a metric twice only the
+    last value is kept, which is the one loaded before, and the rollups are rebuilt
+    to match. Metrics of entries which no longer exist are dropped, and from now on
+    are deleted along with their entry, taking them out of the rollups."""
+    con.execute(
+        "CREATE TABLE metric_name (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)"
+    )
+    con.execute(
+        """INSERT INTO metric_name (name) SELECT DISTINCT metric
+        FROM metric JOIN entry ON entry.uuid=metric.entry ORDER BY metric"""
+    )
+    con.execute(
+        """CREATE TABLE metric_new
+                (entry INTEGER NOT NULL, metric INTEGER NOT NULL, value REAL,
+                PRIMARY KEY (entry, metric)) WITHOUT ROWID"""
+    )
+    # WHERE true stops ON CONFLICT being read as part of the join
+    con.execute(
+        """INSERT INTO metric_new
+        SELECT entry.id, metric_name.id, metric.value
+        FROM metric JOIN entry ON entry.uuid=metric.entry
+        JOIN metric_name ON metric_name.name=metric.metric
+        WHERE true ORDER BY metric.rowid
+        ON CONFLICT DO UPDATE SET value=excluded.value"""
+    )
+    con.execute("DROP TABLE metric")
+    con.execute("ALTER TABLE metric_new RENAME TO metric")
+    con.execute("CREATE INDEX metric_value ON metric (metric, value)")
+    con.execute("DELETE FROM metric_rollup")
+    con.execute(
+        f"""INSERT INTO metric_rollup
+        SELECT diary, metric_name.name, resolution.name,
+            {_rollup_buckets("timestamp")} AS bucket,
+            count(*), sum(value), min(value), max(value)
+        FROM metric JOIN entry ON entry.id=metric.entry
+        JOIN metric_name ON metric_name.id=metric.metric, ({_RESOLUTIONS}) AS resolution
+        WHERE {_ROLLED_UP}
+        GROUP BY diary, metric_name.name, resolution.name, bucket"""
+    )
+    con.execute(
+        f"""CREATE TRIGGER metric_rollup_insert AFTER INSERT ON metric BEGIN
+            INSERT INTO metric_rollup
+            SELECT diary, metric_name.name, resolution.name,
+                {_rollup_buckets("timestamp")} AS bucket,
+                1, new.value, new.value, new.value
+            FROM entry, metric_name, ({_RESOLUTIONS}) AS resolution
+            WHERE entry.id=new.entry AND metric_name.id=new.metric AND {_ROLLED_UP}
+            ON CONFLICT DO UPDATE SET count=count+1, total=total+excluded.total,
+                minimum=min(minimum, excluded.minimum),
+                maximum=max(maximum, excluded.maximum);
+        END"""
+    )
+    # The minimum or maximum may be the value deleted, so the rollups of its buckets
+    # are recomputed from the values left. Only entries within a day either side of
+    # the longest bucket are read, a day covers any offset from UTC.
+    affected = f"""(diary, resolution, metric, bucket) IN (
+        SELECT diary, resolution.name, metric_name.name,
+            {_rollup_buckets("timestamp")} AS bucket
+        FROM entry, metric_name, ({_RESOLUTIONS}) AS resolution
+        WHERE entry.id=old.entry AND metric_name.id=old.metric AND {_ROLLED_UP})"""
+    con.execute(
+        f"""CREATE TRIGGER metric_rollup_delete AFTER DELETE ON metric BEGIN
+            UPDATE metric_rollup SET (count, total, minimum, maximum)=(
+                SELECT count(*), sum(value), min(value), max(value)
+                FROM entry JOIN metric ON metric.entry=entry.id
+                WHERE entry.diary=metric_rollup.diary AND metric.metric=old.metric
+                    AND timestamp >= date(metric_rollup.bucket, '-1 day')
+                    AND timestamp < date(metric_rollup.bucket, '+1 month', '+1 day')
+                    AND {_ISO_TIMESTAMP}
+                    AND {_rollup_buckets("timestamp", "metric_rollup.resolution")}
+                        =metric_rollup.bucket)
+            WHERE {affected};
+            DELETE FROM metric_rollup WHERE count=0 AND {affected};
+        END"""
+    )
+    # Before the entry's gone, so the triggers on metric can still find it
+    con.execute(
+        """CREATE TRIGGER metric_delete BEFORE DELETE ON entry BEGIN
+            DELETE FROM metric WHERE entry=old.id;
+        END"""
+    )
+
+
+@migration
+def add_analysis_update(con: sqlite3.Connection) -> None:
+    """Delete an entry's analysis when its text changes, as posting_update does for the
+    term index, so out of date results can be found without rehashing every text."""
+    con.execute(
+        """CREATE TRIGGER analysis_update AFTER UPDATE OF text ON entry BEGIN
+            DELETE FROM analysis WHERE entry=old.id;
+        END"""
+    )
+
+
+@migration
+def add_metric_version(con: sqlite3.Connection) -> None:
+    """A count of the changes to each diary's metrics, bumped by triggers, so a graph
+    can tell it's out of date when metrics are written after their entry, e.g. those
+    derived in the background."""
+    con.execute(
+        "ALTER TABLE diary ADD COLUMN metric_version INTEGER NOT NULL DEFAULT 0"
+    )
+    for name, event, row in (("insert", "INSERT", "new"), ("delete", "DELETE", "old")):
+        con.execute(
+            f"""CREATE TRIGGER metric_version_{name} AFTER {event} ON metric BEGIN
+                UPDATE diary SET metric_version=metric_version+1
+                WHERE uuid=(SELECT diary FROM entry WHERE id={row}.entry);
+            END"""
+        )
+
+
+@migration
+def drop_analysis(con: sqlite3.Connection) -> None:
+    """Mood is graphed from the nlp.compound metric, so the analysis table and its
+    triggers are no longer needed."""
+    con.execute("DROP TRIGGER analysis_delete")
+    con.execute("DROP TRIGGER analysis_update")
+    con.execute("DROP TABLE analysis")
@@ -1,41 +1,260 @@
-import nltk
+"""Text statistics and sentiment.
+NLTK, and the data it needs, are only loaded the first time they're used, so importing
+this module is cheap. Data already on disk is used without going to the network.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import cache, cached_property, lru_cache, wraps
+from typing import Callable, Optional, Sequence
+import re
 import string
-from nltk.tokenize import sent_tokenize, word_tokenize
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
+import time
 
-nltk.download("punkt")
-nltk.download("stopwords")
-nltk.download("vader_lexicon")
+from .workers import WorkerPool
+
+# Where each NLTK package is found once downloaded, see nltk.data.find
+RESOURCES = {
+    "punkt": "tokenizers/punkt",
+    "stopwords": "corpora/stopwords",
+    "vader_lexicon": "sentiment/vader_lexicon.zip",
+}
 
-stemmer = nltk.PorterStemmer()
-stopwords = nltk.corpus.stopwords.words("english")
-sentiment_analyser = SentimentIntensityAnalyzer()
 word_characters = string.ascii_letters + string.whitespace + string.digits
+_non_word_characters = re.compile(f"[^{re.escape(word_characters)}]+")
+# The ends of contractions and possessives, as word_tokenize splits them off
+_clitic = re.compile(r"(?i)n't|'(?:s|re|ve|ll|d|m)")
+
+# Texts per task sent to the process pool, batches no bigger are done in process
+BATCH_CHUNK_SIZE = 64
+
+
+@cache
+def _missing_resource(name: str) -> Optional[str]:
+    """Why an NLTK data package can't be found even after downloading it, or None if
+    it's installed. Cached, so a failed download isn't tried again on every call."""
+    import nltk
+
+    try:
+        nltk.data.find(RESOURCES[name])
+    except LookupError:
+        nltk.download(name, quiet=True)
+        try:
+            nltk.data.find(RESOURCES[name])
+        except LookupError as error:
+            return str(error)
+    return None
+
+
+def ensure_resource(name: str) -> None:
+    """Download an NLTK data package, but only if it isn't already installed.
+    Raises LookupError if it's missing and can't be downloaded, the download is only
+    attempted once per process."""
+    missing = _missing_resource(name)
+    if missing is not None:
+        raise LookupError(missing)
+
+
+@cache
+def get_stemmer():
+    from nltk.stem import PorterStemmer
+
+    return PorterStemmer()
+
+
+@cache
+def get_stopwords() -> list[str]:
+    ensure_resource("stopwords")
+    from nltk.corpus import stopwords
+
+    return stopwords.words("english")
+
+
+@cache
+def get_stopword_set() -> frozenset[str]:
+    return frozenset(get_stopwords())
+
+
+@lru_cache(maxsize=2**16)
+def stem(word: str) -> str:
+    """Porter stem a word, memoised as the same words come up again and again."""
+    return get_stemmer().stem(word)
+
+
+@cache
+def get_sentiment_analyser():
+    """A VADER analyser, scoring like nltk's SentimentIntensityAnalyzer but faster."""
+    ensure_resource("vader_lexicon")
+    from .vader import FastSentimentAnalyzer
+
+    return FastSentimentAnalyzer.load()
+
+
+def sent_tokenize(text: str) -> list[str]:
+    ensure_resource("punkt")
+    from nltk.tokenize import sent_tokenize
+
+    return sent_tokenize(text)
+
+
+def word_tokenize(text: str, preserve_line: bool = False) -> list[str]:
+    """Split text into words. Unless preserve_line is set it's split into sentences
+    first, which makes no difference to text without sentence-ending punctuation."""
+    if not preserve_line:
+        ensure_resource("punkt")
+    from nltk.tokenize import word_tokenize
+
+    return word_tokenize(text, preserve_line=preserve_line)
+
+
+def __getattr__(name: str):
+    """The module level objects this used to create on import, now made on demand."""
+    getters = {
+        "stemmer": get_stemmer,
+        "stopwords": get_stopwords,
+        "sentiment_analyser": get_sentiment_analyser,
+    }
+    try:
+        return getters[name]()
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def strip_punc(sent: str) -> str:
-    return "".join(c for c in sent if c in word_characters)
+    return _non_word_characters.sub("", sent)
 
 
 def tokenize(sent: str) -> list[str]:
     """Given some prose produe lematised tokens with stopwords stripped."""
-    tokens = word_tokenize(strip_punc(sent).lower())
-    return [stemmer.stem(word) for word in tokens if word not in stopwords]
+    stopwords = get_stopword_set()
+    # With the punctuation gone there's only one sentence, so skip splitting it
+    tokens = word_tokenize(strip_punc(sent).lower(), preserve_line=True)
+    return [stem(word) for word in tokens if word not in stopwords]
+
+
+def _stage(method):
+    """A stage of an Analysis, computed once on first use and timed into
+    self.timings. The time includes any earlier stages it had to compute."""
+
+    @wraps(method)
+    def timed(self):
+        start = time.perf_counter()
+        result = method(self)
+        self.timings[method.__name__] = time.perf_counter() - start
+        return result
+
+    return cached_property(timed)
+
+
+class Analysis:
+    """The analysis of a paragraph, each stage is done once and shared by the
+    statistics built on it. Sentences are split once, the words are found from them,
+    and the content lemmas from the words, rather than tokenising the paragraph
+    again. Sentiment is scored from the paragraph itself, as VADER has its own rules
+    for splitting it, where punctuation and capitals count."""
+
+    def __init__(self, para: str):
+        self.para = para
+        self.timings: dict[str, float] = {}
+
+    @_stage
+    def sents(self) -> list[str]:
+        return sent_tokenize(self.para)
+
+    @_stage
+    def tokens(self) -> list[str]:
+        return [
+            token
+            for sent in self.sents
+            for token in word_tokenize(sent, preserve_line=True)
+        ]
+
+    @_stage
+    def content_lemmas(self) -> list[str]:
+        """tokenize from self.tokens. The clitics word_tokenize splits off, like n't
+        and 's, aren't content words, so "don't" gives nothing where tokenize gives
+        "dont". Otherwise the lemmas are the same."""
+        stopwords = get_stopword_set()
+        words = (
+            strip_punc(token).lower()
+            for token in self.tokens
+            if not _clitic.fullmatch(token)
+        )
+        return [stem(word) for word in words if word and word not in stopwords]
+
+    @_stage
+    def sentiment(self) -> dict[str, float]:
+        return sentiment(self.para)
+
+    def stats(self) -> dict[str, float]:
+        """Counts and averages of the paragraph, and its sentiment. A paragraph without
+        any words, e.g. an empty one, has averages of 0."""
+        sents = self.sents
+        tokens = self.tokens
+        content_lemmas = self.content_lemmas
+        return self.sentiment | {
+            "sent_count": len(sents),
+            "token_count": len(tokens),
+            "content_words": len(content_lemmas),
+            "letters_per_word": sum(len(word) for word in tokens) / max(len(tokens), 1),
+            "words_per_sent": len(tokens) / max(len(sents), 1),
+            "content_per_sent": len(content_lemmas) / max(len(sents), 1),
+        }
 
 
 def stats(para: str) -> dict[str, float]:
-    sents = sent_tokenize(para)
-    tokens = word_tokenize(para)
-    content_lemmas = tokenize(para)
-    return sentiment(para) | {
-        "sent_count": len(sents),
-        "token_count": len(tokens),
-        "content_words": len(content_lemmas),
-        "letters_per_word": sum(len(word) for word in tokens) / len(tokens),
-        "words_per_sent": len(tokens) / len(sents),
-        "content_per_sent": len(content_lemmas) / len(sents),
-    }
+    return Analysis(para).stats()
 
 
 def sentiment(sent: str) -> dict[str, float]:
-    return sentiment_analyser.polarity_scores(sent)
+    return get_sentiment_analyser().polarity_scores(sent)
+
+
+def _init_worker() -> None:
+    """Load the models once per worker, rather than in its first task.
+    Anything missing is left to raise when it's used."""
+    for getter in (get_sentiment_analyser, get_stemmer, get_stopwords):
+        try:
+            getter()
+        except LookupError:
+            pass
+
+
+workers = WorkerPool(_init_worker)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    """The process pool for batch analysis, see WorkerPool."""
+    return workers.get()
+
+
+def _sentiment_chunk(texts: Sequence[str]) -> list[dict[str, float]]:
+    return get_sentiment_analyser().polarity_scores_batch(texts)
+
+
+def _stats_chunk(texts: Sequence[str]) -> list[dict[str, float]]:
+    return [stats(text) for text in texts]
+
+
+def _map_chunks(
+    func: Callable[[Sequence[str]], list[dict[str, float]]],
+    texts: Sequence[str],
+    chunk_size: int,
+) -> list[dict[str, float]]:
+    """Apply func to chunks of texts across the process pool, keeping their order."""
+    if len(texts) <= chunk_size:
+        return func(texts)
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    return [result for chunk in workers.map(func, chunks) for result in chunk]
+
+
+def sentiment_batch(
+    texts: Sequence[str], chunk_size: int = BATCH_CHUNK_SIZE
+) -> list[dict[str, float]]:
+    """sentiment for many texts, spread over every core."""
+    return _map_chunks(_sentiment_chunk, texts, chunk_size)
+
+
+def stats_batch(
+    texts: Sequence[str], chunk_size: int = BATCH_CHUNK_SIZE
+) -> list[dict[str, float]]:
+    """stats for many texts, spread over every core."""
+    return _map_chunks(_stats_chunk, texts, chunk_size)
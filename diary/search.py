@@ -1,6 +1,11 @@
-from typing import Optional
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+import re
 
 from .core import Diary, Entry
+from .db import select_entries, text_condition
 
 
 def strict_search(diary: Diary, search_term: str) -> list[Entry]:
@@ -9,6 +14,126 @@ def strict_search(diary: Diary, search_term: str) -> list[Entry]:
     return [entry for entry in diary.entries if search_term in entry.text]
 
 
+def trigrams(text: str) -> list[str]:
+    """Every run of three characters in text, in order, with repeats."""
+    return [text[i : i + 3] for i in range(len(text) - 2)]
+
+
+def within_distance(a: str, b: str, max_distance: int) -> bool:
+    """Whether a can be made into b with at most max_distance insertions, deletions
+    or substitutions, giving up as soon as every path needs more."""
+    if abs(len(a) - len(b)) > max_distance:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, a_char in enumerate(a, 1):
+        current = [i]
+        for j, b_char in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (a_char != b_char),
+                )
+            )
+        if min(current) > max_distance:
+            return False
+        previous = current
+    return previous[-1] <= max_distance
+
+
+_word = re.compile(r"\w+")
+
+# Intersecting more postings than this rarely rules out enough to be worth it,
+# the remaining candidates are checked directly instead
+MAX_INTERSECTIONS = 3
+
+
+def _sorted_contains(values: array, value: int) -> bool:
+    i = bisect_left(values, value)
+    return i < len(values) and values[i] == value
+
+
+class TrigramIndex:
+    """A case-insensitive index of which entries of a diary contain each trigram, so
+    a search only has to check the entries which contain the trigrams of its term.
+    The words of each entry are indexed too, for fuzzy search.
+    Entries added to the diary are indexed on the next search, entries already
+    indexed shouldn't be edited or removed."""
+
+    def __init__(self, diary: Diary):
+        self.diary = diary
+        # positions in diary.entries, each in ascending order
+        self._trigrams: dict[str, array] = {}
+        self._words: dict[str, array] = {}
+        self._indexed = 0
+
+    def _catch_up(self) -> None:
+        entries = self.diary.entries
+        if len(entries) < self._indexed:
+            self._trigrams = {}
+            self._words = {}
+            self._indexed = 0
+        trigram_postings = self._trigrams
+        word_postings = self._words
+        for position in range(self._indexed, len(entries)):
+            text = entries[position].text.lower()
+            for trigram in {text[i : i + 3] for i in range(len(text) - 2)}:
+                try:
+                    trigram_postings[trigram].append(position)
+                except KeyError:
+                    trigram_postings[trigram] = array("L", (position,))
+            for word in set(_word.findall(text)):
+                try:
+                    word_postings[word].append(position)
+                except KeyError:
+                    word_postings[word] = array("L", (position,))
+        self._indexed = len(entries)
+
+    def _entries(self, positions: Iterable[int], term: str) -> list[Entry]:
+        """The entries at positions which really do contain term."""
+        entries = self.diary.entries
+        return [
+            entries[position]
+            for position in positions
+            if term in entries[position].text.lower()
+        ]
+
+    def search(self, search_term: str) -> list[Entry]:
+        """Entries containing the search term, ignoring case, in diary order."""
+        self._catch_up()
+        term = search_term.lower()
+        if len(term) < 3:
+            return self._entries(range(self._indexed), term)
+        postings = sorted(
+            (
+                self._trigrams.get(trigram, array("L"))
+                for trigram in set(trigrams(term))
+            ),
+            key=len,
+        )
+        candidates: Iterable[int] = postings[0]
+        for posting in postings[1:MAX_INTERSECTIONS]:
+            candidates = [p for p in candidates if _sorted_contains(posting, p)]
+        return self._entries(candidates, term)
+
+    def fuzzy_search(self, search_term: str, max_distance: int = 1) -> list[Entry]:
+        """Entries with, for every word of the search term, a word within max_distance
+        edits of it, ignoring case, in diary order. e.g. "exersize" finds "exercise".
+        Only the distinct words of the diary are compared, not the text of every entry."""
+        self._catch_up()
+        candidates: Optional[set[int]] = None
+        for term in _word.findall(search_term.lower()):
+            matches: set[int] = set()
+            for word, posting in self._words.items():
+                if within_distance(term, word, max_distance):
+                    matches.update(posting)
+            candidates = matches if candidates is None else candidates & matches
+        if candidates is None:
+            return []
+        entries = self.diary.entries
+        return [entries[position] for position in sorted(candidates)]
+
+
 def date_filter(
     entries: list[Entry], *, before: Optional[str] = None, after: Optional[str] = None
 ) -> list[Entry]:
@@ -40,3 +165,152 @@ def metric_filter(
         and (gt is None or entry.metrics[metric] > gt)
         and (eq is None or entry.metrics[metric] == eq)
     ]
+
+
+def _add_sorted(keys: list, positions: list[int], new: list[tuple[Any, int]]) -> None:
+    """Add (key, position) pairs to parallel lists kept sorted by key, then position.
+    A few are inserted in place, many are merged by sorting everything again."""
+    if len(new) * 16 > len(keys):
+        pairs = sorted([*zip(keys, positions), *new])
+        keys[:] = [key for key, _ in pairs]
+        positions[:] = [position for _, position in pairs]
+        return
+    for key, position in new:
+        i = bisect_right(keys, key)
+        keys.insert(i, key)
+        positions.insert(i, position)
+
+
+class DiaryIndex:
+    """Sorted indexes of the timestamps of a diary's entries, and of the values of
+    each metric, so date_filter and metric_filter over the whole diary take
+    O(log n + k) for k results rather than checking every entry.
+    Entries added to the diary, e.g. with Diary.add, are indexed on the next query,
+    entries already indexed shouldn't be edited or removed."""
+
+    def __init__(self, diary: Diary):
+        self.diary = diary
+        # positions in diary.entries, sorted by timestamp or value
+        self._timestamps: list[str] = []
+        self._by_time: list[int] = []
+        self._metrics: dict[str, tuple[list[float], list[int]]] = {}
+        self._indexed = 0
+
+    def _catch_up(self) -> None:
+        entries = self.diary.entries
+        if len(entries) < self._indexed:
+            self._timestamps, self._by_time = [], []
+            self._metrics = {}
+            self._indexed = 0
+        if len(entries) == self._indexed:
+            return
+        times = []
+        metrics: dict[str, list[tuple[float, int]]] = {}
+        for position in range(self._indexed, len(entries)):
+            entry = entries[position]
+            times.append((entry.timestamp, position))
+            for metric, value in entry.metrics.items():
+                try:
+                    metrics[metric].append((value, position))
+                except KeyError:
+                    metrics[metric] = [(value, position)]
+        _add_sorted(self._timestamps, self._by_time, times)
+        for metric, values in metrics.items():
+            _add_sorted(*self._metrics.setdefault(metric, ([], [])), values)
+        self._indexed = len(entries)
+
+    def _entries(self, positions: list[int]) -> list[Entry]:
+        entries = self.diary.entries
+        return [entries[position] for position in sorted(positions)]
+
+    def date_filter(
+        self, *, before: Optional[str] = None, after: Optional[str] = None
+    ) -> list[Entry]:
+        """The same as date_filter over all the diary's entries, in diary order."""
+        self._catch_up()
+        start = bisect_right(self._timestamps, after) if after else 0
+        end = bisect_left(self._timestamps, before) if before else self._indexed
+        return self._entries(self._by_time[start:end])
+
+    def metric_filter(
+        self,
+        metric: str,
+        *,
+        gt: Optional[float] = None,
+        lt: Optional[float] = None,
+        eq: Optional[float] = None,
+    ) -> list[Entry]:
+        """The same as metric_filter over all the diary's entries, in diary order."""
+        self._catch_up()
+        try:
+            values, positions = self._metrics[metric]
+        except KeyError:
+            return []
+        start, end = 0, len(values)
+        if gt is not None:
+            start = max(start, bisect_right(values, gt))
+        if lt is not None:
+            end = min(end, bisect_left(values, lt))
+        if eq is not None:
+            start = max(start, bisect_left(values, eq))
+            end = min(end, bisect_right(values, eq))
+        return self._entries(positions[start:end])
+
+
+@dataclass
+class EntryQuery:
+    """A search combining strict_search, date_filter and metric_filter.
+    Against the database it compiles to a single SQL query so only matching entries
+    are loaded, self.filter applies the same search to entries already in memory."""
+
+    search_term: str = ""
+    before: Optional[str] = None
+    after: Optional[str] = None
+    metric: Optional[str] = None
+    gt: Optional[float] = None
+    lt: Optional[float] = None
+    eq: Optional[float] = None
+
+    def compile(self) -> tuple[str, list]:
+        """Produce an SQL condition over the entry table and its parameters."""
+        conditions: list[str] = []
+        params: list = []
+        if self.search_term:
+            condition, condition_params = text_condition(self.search_term)
+            conditions.append(condition)
+            params.extend(condition_params)
+        if self.before:
+            conditions.append("entry.timestamp < ?")
+            params.append(self.before)
+        if self.after:
+            conditions.append("entry.timestamp > ?")
+            params.append(self.after)
+        if self.metric:
+            metric_conditions = [
+                "m.metric = (SELECT id FROM metric_name WHERE name = ?)"
+            ]
+            params.append(self.metric)
+            for op, bound in ((">", self.gt), ("<", self.lt), ("=", self.eq)):
+                if bound is not None:
+                    metric_conditions.append(f"m.value {op} ?")
+                    params.append(bound)
+            conditions.append(
+                "entry.id IN (SELECT m.entry FROM metric AS m WHERE "
+                + " AND ".join(metric_conditions)
+                + ")"
+            )
+        return " AND ".join(conditions), params
+
+    def execute(self, address: str, username: str) -> list[Entry]:
+        """Run the query against a user's diary in the database."""
+        return select_entries(address, username, *self.compile())
+
+    def filter(self, diary: Diary) -> list[Entry]:
+        """Run the query in memory, for file-backed diaries."""
+        entries = strict_search(diary, self.search_term)
+        entries = date_filter(entries, before=self.before, after=self.after)
+        if self.metric:
+            entries = metric_filter(
+                entries, self.metric, gt=self.gt, lt=self.lt, eq=self.eq
+            )
+        return entries
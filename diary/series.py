@@ -0,0 +1,188 @@
+"""Columnar views of diaries as numpy arrays, for graphing and analysis."""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterator, Optional, Sequence
+import warnings
+
+import numpy as np
+
+from .core import Entry
+from .db import db_cursor, find_diary
+from .migrations import ROLLUP_BUCKETS
+
+Series = tuple[np.ndarray, np.ndarray]
+RESOLUTIONS = tuple(ROLLUP_BUCKETS)
+
+
+@dataclass(slots=True)
+class Rollup:
+    """A metric aggregated over buckets of time, e.g. days. The arrays have one item
+    per bucket, times is the start of the bucket."""
+
+    times: np.ndarray
+    count: np.ndarray
+    total: np.ndarray
+    minimum: np.ndarray
+    maximum: np.ndarray
+
+    @property
+    def mean(self) -> np.ndarray:
+        return self.total / self.count
+
+
+def _naive_utc(timestamp: str) -> datetime:
+    time = datetime.fromisoformat(timestamp)
+    if time.tzinfo is None:
+        return time
+    return time.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_datetime64(timestamps: Sequence[str]) -> np.ndarray:
+    """Parse iso timestamps into a datetime64 array in one go.
+    numpy can't represent timezones, timestamps with an offset are converted to UTC."""
+    with warnings.catch_warnings():
+        # numpy only warns when it drops an offset, with a DeprecationWarning or
+        # UserWarning depending on the version
+        warnings.simplefilter("error")
+        try:
+            return np.array(timestamps, dtype="datetime64[us]")
+        except (ValueError, Warning):
+            pass
+    return np.array([_naive_utc(t) for t in timestamps], dtype="datetime64[us]")
+
+
+def timestamps(entries: Sequence[Entry]) -> np.ndarray:
+    return to_datetime64([entry.timestamp for entry in entries])
+
+
+def metric_series(entries: Sequence[Entry]) -> dict[str, Series]:
+    """For each metric the times of the entries recording it and the values recorded."""
+    times = timestamps(entries)
+    positions: dict[str, list[int]] = {}
+    values: dict[str, list[float]] = {}
+    for position, entry in enumerate(entries):
+        for metric, value in entry.metrics.items():
+            try:
+                positions[metric].append(position)
+                values[metric].append(value)
+            except KeyError:
+                positions[metric] = [position]
+                values[metric] = [value]
+    return {
+        metric: (times[positions[metric]], np.array(values[metric], dtype=np.float64))
+        for metric in positions
+    }
+
+
+def lttb(X: np.ndarray, Y: np.ndarray, points: int) -> Series:
+    """Downsample a series to at most points points by Largest-Triangle-Three-Buckets,
+    which keeps the shape of a line, its peaks and troughs, far better than taking
+    every nth point. The first and last points are kept, and between them one point
+    from each of points - 2 equal buckets, the one making the largest triangle with
+    the previous point kept and the mean of the next bucket.
+    X may be numbers or datetime64. The bucket means are computed all at once, leaving
+    one small vectorised step per bucket, so the cost is O(len(X)) however long."""
+    X = np.asarray(X)
+    Y = np.asarray(Y, dtype=np.float64)
+    n = len(X)
+    if points >= n or points < 3:
+        return X, Y
+    x = X.view(np.int64) if X.dtype.kind in "mM" else X
+    x = x.astype(np.float64)
+
+    # bucket i covers [starts[i], starts[i + 1]), excluding the first and last points
+    starts = (np.arange(points - 1) * ((n - 2) / (points - 2))).astype(np.int64) + 1
+    starts[-1] = n - 1
+    counts = np.diff(starts)
+    mean_x = np.add.reduceat(x[:-1], starts[:-1]) / counts
+    mean_y = np.add.reduceat(Y[:-1], starts[:-1]) / counts
+    # the last bucket is compared with the last point
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, Y[-1])
+
+    kept = np.empty(points, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    previous = 0
+    for i in range(points - 2):
+        start, end = starts[i], starts[i + 1]
+        # twice the area of the triangle, which is as good for finding the largest
+        areas = np.abs(
+            (x[previous] - mean_x[i + 1]) * (Y[start:end] - Y[previous])
+            - (x[previous] - x[start:end]) * (mean_y[i + 1] - Y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return X[kept], Y[kept]
+
+
+def load_metric_series(
+    address: str, username: str, metric: Optional[str] = None
+) -> dict[str, Series]:
+    """metric_series straight from the database, without loading the entries' text.
+    Only the given metric, if there is one."""
+    uuid, _ = find_diary(address, username)
+    where, params = ("AND name=?", (metric,)) if metric else ("", ())
+    with db_cursor(address) as cur:
+        rows = cur.execute(
+            f"""SELECT name, timestamp, value FROM entry
+            JOIN metric ON metric.entry=entry.id
+            JOIN metric_name ON metric_name.id=metric.metric
+            WHERE diary=? {where} ORDER BY name, timestamp""",
+            (uuid, *params),
+        ).fetchall()
+    if not rows:
+        return {}
+    metrics, times, values = zip(*rows)
+    times = to_datetime64(times)
+    values = np.array(values, dtype=np.float64)
+    return {
+        metric: (times[start:end], values[start:end])
+        for metric, start, end in _runs(metrics)
+    }
+
+
+def _runs(metrics: Sequence[str]) -> Iterator[tuple[str, int, int]]:
+    """The start and end of each run of the same metric in a sorted sequence."""
+    start = 0
+    for end in range(1, len(metrics) + 1):
+        if end == len(metrics) or metrics[end] != metrics[start]:
+            yield metrics[start], start, end
+            start = end
+
+
+def load_metric_rollups(
+    address: str, username: str, resolution: str, metric: Optional[str] = None
+) -> dict[str, Rollup]:
+    """Each metric aggregated per day, week or month, read from the rollups kept by
+    the database, so there's one row per bucket however many values were recorded.
+    Only the given metric, if there is one."""
+    if resolution not in ROLLUP_BUCKETS:
+        raise ValueError(f"resolution should be one of {RESOLUTIONS}")
+    uuid, _ = find_diary(address, username)
+    where, params = ("AND metric=?", (metric,)) if metric else ("", ())
+    with db_cursor(address) as cur:
+        rows = cur.execute(
+            f"""SELECT metric, bucket, count, total, minimum, maximum
+            FROM metric_rollup WHERE diary=? AND resolution=? {where}
+            ORDER BY metric, bucket""",
+            (uuid, resolution, *params),
+        ).fetchall()
+    if not rows:
+        return {}
+    metrics, buckets, *columns = zip(*rows)
+    times = np.array(buckets, dtype="datetime64[D]")
+    count = np.array(columns[0], dtype=np.int64)
+    total, minimum, maximum = (
+        np.array(column, dtype=np.float64) for column in columns[1:]
+    )
+    return {
+        metric: Rollup(
+            times[start:end],
+            count[start:end],
+            total[start:end],
+            minimum[start:end],
+            maximum[start:end],
+        )
+        for metric, start, end in _runs(metrics)
+    }
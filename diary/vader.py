@@ -0,0 +1,244 @@
+"""A faster drop-in for NLTK's VADER SentimentIntensityAnalyzer.
+It gives the same polarity_scores, including the quirks, e.g. repeated words are scored
+at their first position. The speed comes from doing the per-text work once: words are
+lowercased once, punctuation is stripped from words without building NLTK's table of
+every word with every punctuation mark, and each distinct word is only scored once.
+"""
+import math
+import string
+from typing import Sequence
+
+from nltk.sentiment.vader import VaderConstants
+
+LEXICON = "sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt"
+
+_constants = VaderConstants()
+B_DECR = _constants.B_DECR
+C_INCR = _constants.C_INCR
+N_SCALAR = _constants.N_SCALAR
+NEGATE = frozenset(_constants.NEGATE)
+BOOSTERS = dict(_constants.BOOSTER_DICT)
+IDIOMS = dict(_constants.SPECIAL_CASE_IDIOMS)
+PUNCTUATION_MARKS = frozenset(_constants.PUNC_LIST)
+REMOVE_PUNCTUATION = _constants.REGEX_REMOVE_PUNCTUATION
+EMPHASIS = ("so", "this")
+
+
+def load_lexicon(resource: str = LEXICON) -> dict[str, float]:
+    """Read the tab separated VADER lexicon into a dict of word to valence."""
+    import nltk.data
+
+    lexicon = {}
+    for line in nltk.data.load(resource).split("\n"):
+        if line.strip():
+            word, measure = line.strip().split("\t")[0:2]
+            lexicon[word] = float(measure)
+    return lexicon
+
+
+class FastSentimentAnalyzer:
+    """Scores text the same way as nltk's SentimentIntensityAnalyzer."""
+
+    def __init__(self, lexicon: dict[str, float]):
+        self.lexicon = lexicon
+
+    @classmethod
+    def load(cls, resource: str = LEXICON) -> "FastSentimentAnalyzer":
+        return cls(load_lexicon(resource))
+
+    def polarity_scores(self, text: str) -> dict[str, float]:
+        words = self._words(text)
+        lowered = [word.lower() for word in words]
+        negated = [word in NEGATE or "n't" in word for word in lowered]
+        capitals = sum(word.isupper() for word in words)
+        is_cap_diff = 0 < len(words) - capitals < len(words)
+
+        # NLTK finds each word with list.index, so a repeated word is scored as if it
+        # were at its first position, and can be scored once.
+        first: dict[str, int] = {}
+        for i, word in enumerate(words):
+            first.setdefault(word, i)
+        valences: dict[int, float] = {}
+        sentiments = []
+        for word in words:
+            i = first[word]
+            try:
+                valence = valences[i]
+            except KeyError:
+                valence = valences[i] = self._valence(
+                    words, lowered, negated, i, is_cap_diff
+                )
+            sentiments.append(valence)
+
+        if "but" in lowered:
+            but = lowered.index("but")
+            for i, valence in enumerate(sentiments):
+                if i < but:
+                    sentiments[i] = valence * 0.5
+                elif i > but:
+                    sentiments[i] = valence * 1.5
+        return self._score(sentiments, text)
+
+    def polarity_scores_batch(self, texts: Sequence[str]) -> list[dict[str, float]]:
+        return [self.polarity_scores(text) for text in texts]
+
+    @staticmethod
+    def _words(text: str) -> list[str]:
+        """Split on whitespace and drop single characters, then strip a leading or
+        trailing punctuation mark when what's left appears as a word in the text with
+        all punctuation removed, as NLTK's SentiText does."""
+        words_only = {
+            word for word in REMOVE_PUNCTUATION.sub("", text).split() if len(word) > 1
+        }
+        words = []
+        for word in text.split():
+            if len(word) <= 1:
+                continue
+            stripped = word.rstrip(string.punctuation)
+            if (
+                len(stripped) < len(word)
+                and word[len(stripped) :] in PUNCTUATION_MARKS
+                and stripped in words_only
+            ):
+                word = stripped
+            else:
+                stripped = word.lstrip(string.punctuation)
+                if (
+                    len(stripped) < len(word)
+                    and word[: len(word) - len(stripped)] in PUNCTUATION_MARKS
+                    and stripped in words_only
+                ):
+                    word = stripped
+            words.append(word)
+        return words
+
+    def _valence(
+        self,
+        words: list[str],
+        lowered: list[str],
+        negated: list[bool],
+        i: int,
+        is_cap_diff: bool,
+    ) -> float:
+        lexicon = self.lexicon
+        item = words[i]
+        lower = lowered[i]
+        if (
+            i < len(words) - 1 and lower == "kind" and lowered[i + 1] == "of"
+        ) or lower in BOOSTERS:
+            return 0
+        try:
+            valence = lexicon[lower]
+        except KeyError:
+            return 0
+
+        if item.isupper() and is_cap_diff:
+            valence = valence + C_INCR if valence > 0 else valence - C_INCR
+
+        for start_i in range(0, 3):
+            j = i - (start_i + 1)
+            if i > start_i and lowered[j] not in lexicon:
+                s = 0.0
+                if lowered[j] in BOOSTERS:
+                    s = BOOSTERS[lowered[j]]
+                    if valence < 0:
+                        s *= -1
+                    if words[j].isupper() and is_cap_diff:
+                        s = s + C_INCR if valence > 0 else s - C_INCR
+                if start_i == 1 and s != 0:
+                    s = s * 0.95
+                if start_i == 2 and s != 0:
+                    s = s * 0.9
+                valence = valence + s
+
+                # negation, or emphasis after "never"
+                if start_i == 0:
+                    if negated[i - 1]:
+                        valence = valence * N_SCALAR
+                elif start_i == 1:
+                    if words[i - 2] == "never" and words[i - 1] in EMPHASIS:
+                        valence = valence * 1.5
+                    elif negated[i - 2]:
+                        valence = valence * N_SCALAR
+                else:
+                    if (words[i - 3] == "never" and words[i - 2] in EMPHASIS) or (
+                        words[i - 1] in EMPHASIS
+                    ):
+                        valence = valence * 1.25
+                    elif negated[i - 3]:
+                        valence = valence * N_SCALAR
+                    valence = self._idioms(valence, words, i)
+
+        if lowered[i - 1] == "least" and "least" not in lexicon:
+            if i > 1:
+                if lowered[i - 2] != "at" and lowered[i - 2] != "very":
+                    valence = valence * N_SCALAR
+            elif i > 0:
+                valence = valence * N_SCALAR
+        return valence
+
+    @staticmethod
+    def _idioms(valence: float, words: list[str], i: int) -> float:
+        onezero = f"{words[i - 1]} {words[i]}"
+        twoonezero = f"{words[i - 2]} {words[i - 1]} {words[i]}"
+        twoone = f"{words[i - 2]} {words[i - 1]}"
+        threetwoone = f"{words[i - 3]} {words[i - 2]} {words[i - 1]}"
+        threetwo = f"{words[i - 3]} {words[i - 2]}"
+        for sequence in (onezero, twoonezero, twoone, threetwoone, threetwo):
+            if sequence in IDIOMS:
+                valence = IDIOMS[sequence]
+                break
+        if len(words) - 1 > i:
+            zeroone = f"{words[i]} {words[i + 1]}"
+            if zeroone in IDIOMS:
+                valence = IDIOMS[zeroone]
+        if len(words) - 1 > i + 1:
+            zeroonetwo = f"{words[i]} {words[i + 1]} {words[i + 2]}"
+            if zeroonetwo in IDIOMS:
+                valence = IDIOMS[zeroonetwo]
+        if threetwo in BOOSTERS or twoone in BOOSTERS:
+            valence = valence + B_DECR
+        return valence
+
+    @staticmethod
+    def _score(sentiments: list[float], text: str) -> dict[str, float]:
+        if not sentiments:
+            return {"neg": 0.0, "neu": 0.0, "pos": 0.0, "compound": 0.0}
+
+        # emphasis from exclamation marks, up to 4, and from 2 or more question marks
+        amplifier = min(text.count("!"), 4) * 0.292
+        question_marks = text.count("?")
+        if question_marks > 3:
+            amplifier += 0.96
+        elif question_marks > 1:
+            amplifier += question_marks * 0.18
+
+        sum_s = float(sum(sentiments))
+        if sum_s > 0:
+            sum_s += amplifier
+        elif sum_s < 0:
+            sum_s -= amplifier
+        compound = sum_s / math.sqrt((sum_s * sum_s) + 15)
+
+        pos_sum = 0.0
+        neg_sum = 0.0
+        neu_count = 0
+        for score in sentiments:
+            if score > 0:
+                pos_sum += float(score) + 1
+            if score < 0:
+                neg_sum += float(score) - 1
+            if score == 0:
+                neu_count += 1
+        if pos_sum > math.fabs(neg_sum):
+            pos_sum += amplifier
+        elif pos_sum < math.fabs(neg_sum):
+            neg_sum -= amplifier
+
+        total = pos_sum + math.fabs(neg_sum) + neu_count
+        return {
+            "neg": round(math.fabs(neg_sum / total), 3),
+            "neu": round(math.fabs(neu_count / total), 3),
+            "pos": round(math.fabs(pos_sum / total), 3),
+            "compound": round(compound, 4),
+        }
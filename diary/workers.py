@@ -0,0 +1,68 @@
+"""Process pools for CPU bound work, e.g. rendering graphs and analysing text.
+Workers are started from a forkserver, as forking the threaded server could copy a
+lock held by another thread into the child, where nothing would ever release it.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Iterable, Optional
+import atexit
+import multiprocessing
+import threading
+
+
+class WorkerPool:
+    """A ProcessPoolExecutor, one worker per core, started on first use. Each worker
+    runs initializer before its first task. A pool broken by a worker dying is
+    replaced on next use, rather than failing every task after."""
+
+    def __init__(self, initializer: Optional[Callable[[], None]] = None):
+        self.initializer = initializer
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> ProcessPoolExecutor:
+        """The current pool, starting one if there isn't one."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    mp_context=multiprocessing.get_context("forkserver"),
+                    initializer=self.initializer,
+                )
+                atexit.register(self._executor.shutdown)
+            return self._executor
+
+    def discard(self, broken: ProcessPoolExecutor) -> None:
+        """Stop using a broken pool, unless it's already been replaced."""
+        with self._lock:
+            if self._executor is broken:
+                self._executor = None
+        broken.shutdown(wait=False)
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """executor.submit, retried once on a new pool if the current one is broken.
+        A task which finds the pool broken raises BrokenProcessPool, and the pool is
+        replaced for the next."""
+        executor = self.get()
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self.discard(executor)
+            return self.get().submit(fn, *args, **kwargs)
+        future.add_done_callback(
+            lambda future: self._discard_if_broken(executor, future)
+        )
+        return future
+
+    def map(self, fn: Callable, iterable: Iterable) -> list[Any]:
+        """executor.map as a list. Raises BrokenProcessPool if a worker dies, and the
+        pool is replaced for the next call."""
+        executor = self.get()
+        try:
+            return list(executor.map(fn, iterable))
+        except BrokenProcessPool:
+            self.discard(executor)
+            raise
+
+    def _discard_if_broken(self, executor: ProcessPoolExecutor, future: Future) -> None:
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.discard(executor)
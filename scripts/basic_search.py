@@ -1,17 +1,36 @@
 import argparse
 from diary.core import Diary
-from diary.search import strict_search
+from diary.search import DiaryIndex, TrigramIndex, date_filter
 
 parser = argparse.ArgumentParser(description="Search a basic file-backed diary.")
 parser.add_argument("file", type=str, help="filename")
+parser.add_argument(
+    "--fuzzy",
+    type=int,
+    default=None,
+    help="match words within this many typos, instead of a substring",
+)
+parser.add_argument("--after", type=str, default=None, help="only after this time")
+parser.add_argument("--before", type=str, default=None, help="only before this time")
 
 args = parser.parse_args()
 with open(args.file, "r") as f:
     diary = Diary.load(f)
 
 print(diary.name)
+index = TrigramIndex(diary)
+dates = DiaryIndex(diary)
 
 while True:
     search_term = input("search:")
-    for entry in strict_search(diary, search_term):
+    if not search_term:
+        # everything in the date range, found without checking every entry
+        entries = dates.date_filter(before=args.before, after=args.after)
+    else:
+        if args.fuzzy is None:
+            entries = index.search(search_term)
+        else:
+            entries = index.fuzzy_search(search_term, args.fuzzy)
+        entries = date_filter(entries, before=args.before, after=args.after)
+    for entry in entries:
         print(entry)
@@ -0,0 +1,66 @@
+import argparse
+import os
+import time
+
+import numpy as np
+
+from diary.graphs import GraphCache, get_pool, render_png
+from diary.series import lttb
+
+parser = argparse.ArgumentParser(
+    description="Time rendering a graph of a random walk with every point, against "
+    "downsampling it with diary.series.lttb first."
+)
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[1_000, 10_000, 100_000, 1_000_000],
+    help="numbers of points",
+)
+parser.add_argument("--points", type=int, default=500, help="points to keep")
+parser.add_argument(
+    "--graphs", type=int, default=15, help="graphs on a page, rendered together"
+)
+
+args = parser.parse_args()
+rng = np.random.default_rng(0)
+render_png([0, 1], [0, 1])  # import matplotlib before timing anything
+
+for size in args.sizes:
+    X = np.datetime64("2001-01-01") + np.arange(size).astype("timedelta64[h]")
+    Y = np.cumsum(rng.normal(size=size))
+
+    start = time.perf_counter()
+    full = render_png(X, Y)
+    full_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    X_kept, Y_kept = lttb(X, Y, args.points)
+    lttb_time = time.perf_counter() - start
+    downsampled = render_png(X_kept, Y_kept)
+    downsampled_time = time.perf_counter() - start
+
+    print(
+        f"{size:8} points  every point {full_time * 1000:7.1f}ms {len(full):7}B"
+        f"  lttb {lttb_time * 1000:6.1f}ms + render"
+        f" {downsampled_time * 1000:7.1f}ms {len(downsampled):7}B"
+    )
+
+graphs = {
+    f"metric{i}": (np.arange(args.points), np.cumsum(rng.normal(size=args.points)))
+    for i in range(args.graphs)
+}
+start = time.perf_counter()
+for name, (X, Y) in graphs.items():
+    GraphCache().png(name, X, Y)
+sequential_time = time.perf_counter() - start
+
+list(get_pool().map(int, range(os.cpu_count() or 1)))  # start the workers first
+start = time.perf_counter()
+GraphCache().render_all(graphs)
+parallel_time = time.perf_counter() - start
+print(
+    f"{args.graphs} graphs  one at a time {sequential_time * 1000:7.1f}ms"
+    f"  render_all {parallel_time * 1000:7.1f}ms"
+)
@@ -0,0 +1,38 @@
+import argparse
+import statistics
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser(
+    description="Time a fresh interpreter importing the app, with and without the "
+    "heavy libraries it now defers until they're used."
+)
+parser.add_argument("-n", type=int, default=10, help="number of runs of each")
+
+STATEMENTS = {
+    "import diary.app": "import diary.app",
+    "... plus nltk, numpy and matplotlib": "import diary.app, nltk, nltk.sentiment.vader, numpy, matplotlib.figure",
+}
+
+
+def time_import(statement: str) -> float:
+    """Seconds for a new interpreter to run the statement, measured inside it so
+    interpreter start up isn't counted."""
+    code = f"import time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    return float(subprocess.check_output([sys.executable, "-c", code], text=True))
+
+
+args = parser.parse_args()
+for name, statement in STATEMENTS.items():
+    times = [time_import(statement) for _ in range(args.n)]
+    print(f"{name:40} median {statistics.median(times) * 1000:7.1f}ms")
+
+loaded = subprocess.check_output(
+    [
+        sys.executable,
+        "-c",
+        "import sys, diary.app; print(*sorted({m for m in ('nltk', 'numpy', 'matplotlib') if m in sys.modules}))",
+    ],
+    text=True,
+).strip()
+print("heavy modules loaded by import diary.app:", loaded or "none")
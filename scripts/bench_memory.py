@@ -0,0 +1,73 @@
+import argparse
+import random
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from diary.core import Entry, compact_metrics
+
+parser = argparse.ArgumentParser(
+    description="Compare the memory used per entry by slotted and plain entries."
+)
+parser.add_argument("-n", type=int, default=100_000, help="number of entries")
+parser.add_argument(
+    "--metric-rate", type=float, default=0.3, help="fraction of entries with a metric"
+)
+
+
+@dataclass
+class PlainEntry:
+    """Entry as it was before it was slotted, for comparison."""
+
+    timestamp: str
+    text: str
+    metrics: dict[str, float]
+    uuid: str
+
+
+def rows(n: int, metric_rate: float) -> list[tuple]:
+    """Synthetic entries, metric names are built afresh each time, as they are when
+    read from the DB or a file."""
+    start = datetime(2000, 1, 1)
+    return [
+        (
+            (start + timedelta(hours=i)).isoformat(),
+            f"entry number {i}",
+            {"".join(["mo", "od"]): float(i % 10)}
+            if random.random() < metric_rate
+            else {},
+            str(uuid4()),
+        )
+        for i in range(n)
+    ]
+
+
+def measure(build) -> int:
+    tracemalloc.start()
+    entries = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del entries
+    return size
+
+
+args = parser.parse_args()
+data = rows(args.n, args.metric_rate)
+plain = measure(
+    lambda: [
+        PlainEntry(ts, text, dict(metrics), uuid) for ts, text, metrics, uuid in data
+    ]
+)
+compact = measure(
+    lambda: [
+        Entry(ts, text, compact_metrics(metrics), uuid)
+        for ts, text, metrics, uuid in data
+    ]
+)
+print(f"{args.n} entries, excluding the timestamp, text and uuid strings")
+print(f"plain:   {plain / args.n:6.1f} bytes per entry")
+print(f"slotted: {compact / args.n:6.1f} bytes per entry")
+print(
+    f"saving:  {(plain - compact) / args.n:6.1f} bytes per entry ({1 - compact / plain:.0%})"
+)
@@ -0,0 +1,75 @@
+import argparse
+import time
+from collections import defaultdict
+
+from diary.core import Diary
+from diary.nlp import (
+    Analysis,
+    get_stemmer,
+    get_stopwords,
+    sent_tokenize,
+    sentiment,
+    word_characters,
+    word_tokenize,
+)
+
+parser = argparse.ArgumentParser(
+    description="Time each stage of diary.nlp.stats over a file-backed diary, "
+    "against the previous pipeline which tokenised each paragraph several times."
+)
+parser.add_argument("file", type=str, help="filename, e.g. tests/dracula.diary")
+parser.add_argument("-n", type=int, default=None, help="only use the first n entries")
+
+
+def legacy_stats(para: str) -> dict[str, float]:
+    """stats as it was, for comparison."""
+    stemmer = get_stemmer()
+    stopwords = get_stopwords()
+    sents = sent_tokenize(para)
+    tokens = word_tokenize(para)
+    stripped = "".join(c for c in para if c in word_characters)
+    content_lemmas = [
+        stemmer.stem(word)
+        for word in word_tokenize(stripped.lower())
+        if word not in stopwords
+    ]
+    return sentiment(para) | {
+        "sent_count": len(sents),
+        "token_count": len(tokens),
+        "content_words": len(content_lemmas),
+        "letters_per_word": sum(len(word) for word in tokens) / len(tokens),
+        "words_per_sent": len(tokens) / len(sents),
+        "content_per_sent": len(content_lemmas) / len(sents),
+    }
+
+
+args = parser.parse_args()
+with open(args.file, "r") as f:
+    diary = Diary.load(f)
+texts = [entry.text for entry in diary.entries[: args.n] if entry.text.strip()]
+
+# Warm up the lazily loaded models so neither side pays for loading them
+legacy_stats(texts[0])
+Analysis(texts[0]).stats()
+
+start = time.perf_counter()
+legacy = [legacy_stats(text) for text in texts]
+legacy_time = time.perf_counter() - start
+
+timings: dict[str, float] = defaultdict(float)
+start = time.perf_counter()
+results = []
+for text in texts:
+    analysis = Analysis(text)
+    results.append(analysis.stats())
+    for stage, seconds in analysis.timings.items():
+        timings[stage] += seconds
+analysis_time = time.perf_counter() - start
+
+assert results == legacy, "Analysis.stats doesn't match the previous pipeline"
+print(f"{len(texts)} paragraphs")
+for stage, seconds in timings.items():
+    print(f"  {stage:16} {seconds * 1000:8.1f}ms")
+print(f"previous stats   {legacy_time * 1000:8.1f}ms")
+print(f"Analysis.stats   {analysis_time * 1000:8.1f}ms")
+print(f"speed up         {legacy_time / analysis_time:8.2f}x")
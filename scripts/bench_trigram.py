@@ -0,0 +1,90 @@
+import argparse
+import re
+import time
+
+from diary.core import Diary, Entry
+from diary.search import TrigramIndex, strict_search, within_distance
+
+words = re.compile(r"\w+")
+
+parser = argparse.ArgumentParser(
+    description="Compare searching with diary.search.TrigramIndex against a linear "
+    "scan, over diaries of each size built by repeating the sentences of a diary."
+)
+parser.add_argument("file", type=str, help="filename, e.g. tests/dracula.diary")
+parser.add_argument(
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[10_000, 100_000, 1_000_000],
+    help="numbers of entries",
+)
+parser.add_argument(
+    "--terms", nargs="+", default=["garlic", "Van Helsing", "the"], help="substrings"
+)
+parser.add_argument("--fuzzy", default="exersize", help="term for fuzzy search")
+parser.add_argument("--distance", type=int, default=2, help="edits for fuzzy search")
+parser.add_argument(
+    "--fuzzy-scan-limit",
+    type=int,
+    default=100_000,
+    help="skip the linear fuzzy scan above this many entries, as it's so slow",
+)
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+args = parser.parse_args()
+with open(args.file, "r") as f:
+    source = Diary.load(f)
+lines = [
+    sentence
+    for entry in source.entries
+    for sentence in re.split(r"(?<=[.!?])\s+", entry.text)
+    if sentence.strip()
+]
+
+for size in args.sizes:
+    entries = [Entry(str(i), lines[i % len(lines)], {}) for i in range(size)]
+    diary = Diary("bench", entries)
+    index = TrigramIndex(diary)
+    _, build = timed(lambda: index.search(""))
+    print(f"{size} entries, index built in {build * 1000:.0f}ms")
+    print(f"  {len(index._trigrams)} trigrams, {len(index._words)} words")
+
+    for term in args.terms:
+        lower = term.lower()
+        scanned, scan = timed(
+            lambda: [e for e in diary.entries if lower in e.text.lower()]
+        )
+        _, strict = timed(lambda: strict_search(diary, term))
+        found, search = timed(lambda: index.search(term))
+        assert found == scanned
+        print(
+            f"  {term!r:14} {len(found):8} found"
+            f"  strict_search {strict * 1000:8.1f}ms"
+            f"  lower scan {scan * 1000:8.1f}ms"
+            f"  index {search * 1000:8.1f}ms  {scan / search:6.1f}x"
+        )
+
+    term = args.fuzzy.lower()
+    found, search = timed(lambda: index.fuzzy_search(term, args.distance))
+    line = f"  ~{term!r:13} {len(found):8} found  index {search * 1000:8.1f}ms"
+    if size <= args.fuzzy_scan_limit:
+        scanned, scan = timed(
+            lambda: [
+                e
+                for e in diary.entries
+                if any(
+                    within_distance(term, word, args.distance)
+                    for word in words.findall(e.text.lower())
+                )
+            ]
+        )
+        assert found == scanned
+        line += f"  scan {scan * 1000:8.1f}ms  {scan / search:6.1f}x"
+    print(line)
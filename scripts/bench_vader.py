@@ -0,0 +1,53 @@
+import argparse
+import time
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+from diary.core import Diary
+from diary.nlp import ensure_resource
+from diary.vader import FastSentimentAnalyzer
+
+parser = argparse.ArgumentParser(
+    description="Compare the throughput of diary.vader.FastSentimentAnalyzer with "
+    "nltk's SentimentIntensityAnalyzer over a file-backed diary."
+)
+parser.add_argument("file", type=str, help="filename, e.g. tests/dracula.diary")
+parser.add_argument("-n", type=int, default=None, help="only use the first n entries")
+parser.add_argument("--repeat", type=int, default=3, help="take the best of this many")
+
+
+def best_time(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+args = parser.parse_args()
+with open(args.file, "r") as f:
+    diary = Diary.load(f)
+texts = [entry.text for entry in diary.entries[: args.n]]
+characters = sum(len(text) for text in texts)
+
+ensure_resource("vader_lexicon")
+start = time.perf_counter()
+analyser = SentimentIntensityAnalyzer()
+nltk_load = time.perf_counter() - start
+start = time.perf_counter()
+fast = FastSentimentAnalyzer.load()
+fast_load = time.perf_counter() - start
+
+expected = [analyser.polarity_scores(text) for text in texts]
+assert fast.polarity_scores_batch(texts) == expected, "scores differ from nltk's"
+
+nltk_time = best_time(lambda: [analyser.polarity_scores(t) for t in texts], args.repeat)
+fast_time = best_time(lambda: fast.polarity_scores_batch(texts), args.repeat)
+
+print(f"{len(texts)} texts, {characters} characters")
+print(f"nltk  load {nltk_load * 1000:7.1f}ms  score {nltk_time * 1000:8.1f}ms", end="")
+print(f"  {len(texts) / nltk_time:9.0f} texts/s")
+print(f"fast  load {fast_load * 1000:7.1f}ms  score {fast_time * 1000:8.1f}ms", end="")
+print(f"  {len(texts) / fast_time:9.0f} texts/s")
+print(f"speed up {nltk_time / fast_time:.2f}x")
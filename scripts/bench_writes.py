@@ -0,0 +1,82 @@
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from diary.core import Diary, Entry
+from diary.db import (
+    _index_terms,
+    create_diary,
+    create_entry,
+    db_cursor,
+    insert_metrics,
+    writer,
+)
+
+parser = argparse.ArgumentParser(
+    description="Time many threads adding entries at once, each in its own "
+    "transaction, against create_entry's group commit."
+)
+parser.add_argument("--threads", type=int, default=16, help="concurrent writers")
+parser.add_argument("-n", type=int, default=100, help="entries per thread")
+
+
+def separate_transactions(address: str, diary_uuid: str, entry: Entry) -> None:
+    """How create_entry used to write, one transaction per entry."""
+    with db_cursor(address) as cur:
+        cur.execute(
+            "INSERT INTO entry (uuid, diary, timestamp, text) VALUES (?, ?, ?, ?)",
+            (entry.uuid, diary_uuid, entry.timestamp, entry.text),
+        )
+        insert_metrics(
+            cur,
+            [(entry.uuid, metric, value) for metric, value in entry.metrics.items()],
+        )
+        _index_terms(cur, diary_uuid)
+
+
+def run(write, address: str, diary_uuid: str) -> tuple[float, int]:
+    """Seconds for every thread to write its entries, and how many writes failed."""
+    errors = []
+
+    def write_entries(thread: int) -> None:
+        for i in range(args.n):
+            try:
+                write(address, diary_uuid, Entry.create(f"entry {i} #thread {thread}"))
+            except sqlite3.OperationalError as error:
+                errors.append(error)
+
+    threads = [
+        threading.Thread(target=write_entries, args=(thread,))
+        for thread in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, len(errors)
+
+
+args = parser.parse_args()
+writes = args.threads * args.n
+with tempfile.TemporaryDirectory() as directory:
+    for name, write in (
+        ("separate", separate_transactions),
+        ("group commit", create_entry),
+    ):
+        address = os.path.join(directory, name.replace(" ", "_") + ".db")
+        diary = Diary("bench", [])
+        create_diary(address, diary, "bench")
+        transactions = writer.transactions
+        seconds, errors = run(write, address, diary.uuid)
+        print(
+            f"{name:12} {writes} entries in {seconds * 1000:8.1f}ms"
+            f"  {writes / seconds:8.0f} entries/s  {errors} failed",
+            end="",
+        )
+        if write is create_entry:
+            print(f"  {writer.transactions - transactions} transactions", end="")
+        print()
@@ -1,5 +1,6 @@
 import argparse
 from diary.core import Diary
+from diary.search import DiaryIndex, date_filter
 
 parser = argparse.ArgumentParser(
     description="Read the metrics tagged with a given name from a file-backed diary."
@@ -12,6 +13,10 @@ parser.add_argument(
     help="Verbose, include the full diary entry as well",
     action="store_true",
 )
+parser.add_argument("--gt", type=float, default=None, help="only values above this")
+parser.add_argument("--lt", type=float, default=None, help="only values below this")
+parser.add_argument("--after", type=str, default=None, help="only after this time")
+parser.add_argument("--before", type=str, default=None, help="only before this time")
 
 args = parser.parse_args()
 with open(args.file, "r") as f:
@@ -19,8 +24,8 @@ with open(args.file, "r") as f:
 
 print(diary.name)
 
-for entry in diary.entries:
-    if args.tag in entry.metrics:
-        print(entry.timestamp, entry.metrics[args.tag])
+entries = DiaryIndex(diary).metric_filter(args.tag, gt=args.gt, lt=args.lt)
+for entry in date_filter(entries, before=args.before, after=args.after):
+    print(entry.timestamp, entry.metrics[args.tag])
     if args.verbose:
         print(entry)
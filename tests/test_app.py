@@ -1,9 +1,17 @@
 import unittest
+from unittest import mock
 from datetime import datetime, timedelta
 
-from diary.app import app
+from diary.app import app, metric_writer
 from diary.core import Diary, Entry
-from diary.db import create_diary, load_diary, drop_db
+from diary.db import (
+    create_diary,
+    create_entry,
+    db_cursor,
+    drop_db,
+    insert_metrics,
+    load_diary,
+)
 
 
 DB_ADDRESS = "tmp/testing.db"
@@ -62,12 +70,150 @@ class TestRead(FromDB):
             response.data,
         )
 
+    def test_read_derived_hidden(self):
+        with db_cursor(DB_ADDRESS) as cur:
+            insert_metrics(cur, [(self.diary.entries[2].uuid, "nlp.compound", 0.5)])
+        response = self.client.get("/read/username")
+        self.assertIn(b"<strong>#metric:</strong> 1", response.data)
+        self.assertNotIn(b"#nlp.", response.data)
+
+    def test_read_pages(self):
+        app.config["PAGE_SIZE"] = 2
+        try:
+            response = self.client.get("/read/username")
+            self.assertIn(b"<em>2001-01-02</em> - text2", response.data)
+            self.assertNotIn(b"<em>2001-01-03</em> - text3", response.data)
+            self.assertIn(b"Next", response.data)
+            url = response.data.split(b'<a href="')[1].split(b'"')[0].decode()
+            response = self.client.get(url.replace("&amp;", "&"))
+            self.assertNotIn(b"<em>2001-01-02</em> - text2", response.data)
+            self.assertIn(b"<em>2001-01-03</em> - text3", response.data)
+            response = self.client.get(
+                "/read/username", query_string={"after": "2001-01-04"}
+            )
+            self.assertIn(b"<em>2001-01-05</em> - text2", response.data)
+            self.assertNotIn(b"Next", response.data)
+        finally:
+            app.config["PAGE_SIZE"] = 100
+
     def test_read_right_user(self):
         response = self.client.get("/read/username")
         self.assertNotIn(b"<h1>wrong name</h1>", response.data)
         self.assertNotIn(b"<em>2001-01-01</em> - wrong entry", response.data)
 
 
+class TestGraphs(FromDB):
+    def test_metrics(self):
+        response = self.client.get("/metrics/username")
+        self.assertIn(b"<h1>diary name</h1>", response.data)
+        self.assertIn(b"<h2>metric</h2>", response.data)
+        self.assertIn(b"<h2>tag</h2>", response.data)
+        self.assertIn(b"src='/metrics/username/metric.png'", response.data)
+        self.assertIn(b"src='/metrics/username/tag.png'", response.data)
+        self.assertNotIn(b"base64", response.data)
+
+    def test_metrics_resolution(self):
+        response = self.client.get("/metrics/username?resolution=week")
+        self.assertIn(
+            b"src='/metrics/username/metric.png?resolution=week'", response.data
+        )
+        for resolution in ("raw", "day", "week", "month"):
+            with self.subTest(resolution=resolution):
+                response = self.client.get(
+                    "/metrics/username/metric.png",
+                    query_string={"resolution": resolution},
+                )
+                self.assertEqual(response.mimetype, "image/png")
+                self.assertTrue(response.data.startswith(b"\x89PNG"))
+        response = self.client.get("/metrics/username?resolution=hour")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/metrics/username/metric.png?resolution=hour")
+        self.assertEqual(response.status_code, 400)
+
+    def test_metrics_rendered(self):
+        """The page renders its graphs, so fetching them only hits the cache."""
+        from diary.app import graph_cache
+
+        self.client.get("/metrics/username")
+        renders = graph_cache.renders
+        self.client.get("/metrics/username/metric.png")
+        self.client.get("/metrics/username/tag.png")
+        self.assertEqual(graph_cache.renders, renders)
+
+    def test_missing_metric(self):
+        response = self.client.get("/metrics/username/missing.png")
+        self.assertEqual(response.status_code, 404)
+
+    def test_mood(self):
+        response = self.client.get("/mood/username")
+        self.assertIn(b"<h1>diary name</h1>", response.data)
+        self.assertIn(b"<h2>mood</h2>", response.data)
+        self.assertIn(b"src='/mood/username.png'", response.data)
+        response = self.client.get("/mood/username.png")
+        self.assertEqual(response.mimetype, "image/png")
+        self.assertTrue(response.data.startswith(b"\x89PNG"))
+
+    def test_mood_metric(self):
+        """Mood is graphed from nlp.compound, derived once for entries without it."""
+        etag = self.client.get("/mood/username.png").headers["ETag"]
+        with db_cursor(DB_ADDRESS) as cur:
+            counts = cur.execute(
+                """SELECT entry.uuid, count(*) FROM entry
+                JOIN metric ON metric.entry=entry.id
+                JOIN metric_name ON metric_name.id=metric.metric
+                WHERE diary=? AND name='nlp.compound' GROUP BY entry.uuid""",
+                (self.diary.uuid,),
+            ).fetchall()
+        self.assertEqual(dict(counts), {entry.uuid: 1 for entry in self.diary.entries})
+        with mock.patch.object(metric_writer, "backfill") as backfill:
+            response = self.client.get(
+                "/mood/username.png", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+        backfill.assert_not_called()
+
+    def test_conditional(self):
+        response = self.client.get("/metrics/username/metric.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.last_modified)
+        etag = response.headers["ETag"]
+
+        response = self.client.get(
+            "/metrics/username/metric.png", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+        # other graphs, and the same graph once the diary changes, are new
+        response = self.client.get(
+            "/metrics/username/tag.png", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        create_entry(DB_ADDRESS, self.diary.uuid, Entry.create("#metric 5"))
+        response = self.client.get(
+            "/metrics/username/metric.png", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_late_metrics(self):
+        """Metrics written after their entry, as derived metrics are, change the graph."""
+        response = self.client.get("/metrics/username/metric.png")
+        etag = response.headers["ETag"]
+        with db_cursor(DB_ADDRESS) as cur:
+            insert_metrics(cur, [(self.diary.entries[0].uuid, "metric", 3)])
+        response = self.client.get(
+            "/metrics/username/metric.png", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        response = self.client.get(
+            "/metrics/username/metric.png",
+            headers={"If-Modified-Since": "Fri, 05 Jan 2001 00:00:00 GMT"},
+        )
+        self.assertEqual(response.status_code, 200)
+
+
 class TestCreate(FromDB):
     def test_form(self):
         response = self.client.get("/create/")
@@ -117,6 +263,26 @@ class TestAdd(FromDB):
         self.assertAlmostEqual(entry.time, now, delta=timedelta(seconds=1))
         self.assertEqual(entry.text, "text of a newly-created entry")
 
+    def test_derived_metrics(self):
+        self.client.post("/add/username", data={"entry_text": "a lovely day"})
+        metric_writer.drain()
+        entry = load_diary(DB_ADDRESS, "username").entries[-1]
+        self.assertEqual(entry.text, "a lovely day")
+        self.assertIn("nlp.compound", entry.metrics)
+
+    def test_recent_only(self):
+        app.config["PAGE_SIZE"] = 2
+        try:
+            response = self.client.post(
+                "/add/username", data={"entry_text": "newest entry #mood 3"}
+            )
+        finally:
+            app.config["PAGE_SIZE"] = 100
+        self.assertNotIn(b"<em>2001-01-04</em> - text1", response.data)
+        self.assertIn(b"<em>2001-01-05</em> - text2", response.data)
+        self.assertIn(b"newest entry #mood 3", response.data)
+        self.assertIn(b"<strong>#mood:</strong> 3.0", response.data)
+
 
 class TestSearch(FromDB):
     def test_form(self):
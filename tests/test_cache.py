@@ -0,0 +1,64 @@
+import unittest
+
+from diary.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = LRUCache(10)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.hit_rate, 0.5)
+
+    def test_evicts_least_recent(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+
+    def test_weight(self):
+        cache = LRUCache(5, weigh=len)
+        cache.put("a", [1, 2, 3])
+        cache.put("b", [1, 2])
+        self.assertEqual(cache.weight, 5)
+        cache.put("c", [1])
+        self.assertNotIn("a", cache)
+        self.assertEqual(cache.weight, 3)
+        cache.put("d", [1, 2, 3, 4, 5, 6])
+        self.assertNotIn("d", cache)
+
+    def test_replace(self):
+        cache = LRUCache(5, weigh=len)
+        cache.put("a", [1, 2, 3])
+        cache.put("a", [1])
+        self.assertEqual(cache.weight, 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_invalidate(self):
+        cache = LRUCache(10)
+        cache.put(("x", "a"), 1)
+        cache.put(("y", "b"), 2)
+        cache.invalidate(lambda key, value: key[0] == "x")
+        self.assertNotIn(("x", "a"), cache)
+        self.assertIn(("y", "b"), cache)
+        cache.clear()
+        self.assertEqual((len(cache), cache.weight), (0, 0))
+
+    def test_stale_put(self):
+        cache = LRUCache(10)
+        generation = cache.generation
+        cache.invalidate(lambda key, value: True)
+        cache.put("a", 1, generation)
+        self.assertNotIn("a", cache)
+        cache.put("a", 1, cache.generation)
+        self.assertIn("a", cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
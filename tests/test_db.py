@@ -1,9 +1,28 @@
 import sqlite3
+import threading
+import time
 import unittest
+from unittest import mock
 
 
 from diary.core import Diary, Entry
-from diary.db import create_diary, load_diary, create_entry, drop_db
+from diary.db import (
+    create_diary,
+    load_diary,
+    create_entry,
+    db_cursor,
+    diary_cache,
+    drop_db,
+    find_diary,
+    ConnectionPool,
+    GroupCommitWriter,
+    iter_entries,
+    PRAGMAS,
+    ranked_search,
+    recent_entries,
+    writer,
+)
+from diary.nlp import tokenize
 
 DB_ADDRESS = "tmp/testing.db"
 
@@ -32,6 +51,22 @@ class TestDB(unittest.TestCase):
         self.assertEquals(len(diary.entries), 4)
         self.assertEqual(diary.entries[-1], self.entry4)
 
+    def test_cached(self):
+        create_diary(DB_ADDRESS, self.diary, "username")
+        hits = diary_cache.hits
+        diary = load_diary(DB_ADDRESS, "username")
+        self.assertIs(load_diary(DB_ADDRESS, "username"), diary)
+        self.assertEqual(diary_cache.hits, hits + 1)
+
+    def test_cache_invalidated(self):
+        create_diary(DB_ADDRESS, self.diary, "username")
+        load_diary(DB_ADDRESS, "username")
+        create_entry(DB_ADDRESS, self.diary.uuid, self.entry4)
+        self.assertEqual(load_diary(DB_ADDRESS, "username").entries[-1], self.entry4)
+        drop_db(DB_ADDRESS)
+        with self.assertRaises(LookupError):
+            load_diary(DB_ADDRESS, "username")
+
     def test_uniqueness(self):
         create_diary(DB_ADDRESS, self.diary, "username")
         with self.assertRaises(sqlite3.DatabaseError):
@@ -43,5 +78,361 @@ class TestDB(unittest.TestCase):
             create_entry(DB_ADDRESS, self.diary.uuid, self.entry1)
 
 
+class TestIterEntries(unittest.TestCase):
+    def setUp(self):
+        self.entries = [
+            Entry(f"2001-01-{day:02}", f"entry{day}", {"day": day})
+            for day in range(1, 11)
+        ]
+        # entries sharing a timestamp are ordered by uuid
+        self.entries += sorted(
+            (Entry("2001-01-11", "same time", {}) for _ in range(3)),
+            key=lambda entry: entry.uuid,
+        )
+        self.diary = Diary("name", self.entries)
+        create_diary(DB_ADDRESS, self.diary, "username")
+
+    def tearDown(self) -> None:
+        drop_db(DB_ADDRESS)
+
+    def test_find_diary(self):
+        self.assertEqual(
+            find_diary(DB_ADDRESS, "username"), (self.diary.uuid, self.diary.name)
+        )
+        with self.assertRaises(LookupError):
+            find_diary(DB_ADDRESS, "nobody")
+
+    def test_all(self):
+        self.assertEqual(
+            list(iter_entries(DB_ADDRESS, "username", batch_size=3)), self.entries
+        )
+
+    def test_limit(self):
+        self.assertEqual(
+            list(iter_entries(DB_ADDRESS, "username", limit=4, batch_size=3)),
+            self.entries[:4],
+        )
+
+    def test_after_timestamp(self):
+        self.assertEqual(
+            list(iter_entries(DB_ADDRESS, "username", after_timestamp="2001-01-08")),
+            self.entries[8:],
+        )
+
+    def test_recent(self):
+        self.assertEqual(
+            recent_entries(DB_ADDRESS, self.diary.uuid, 4), self.entries[-4:]
+        )
+        self.assertEqual(recent_entries(DB_ADDRESS, self.diary.uuid, 100), self.entries)
+
+    def test_keyset(self):
+        pages = []
+        after = {}
+        while True:
+            page = list(iter_entries(DB_ADDRESS, "username", limit=5, **after))
+            if not page:
+                break
+            pages.append(page)
+            after = {
+                "after_timestamp": page[-1].timestamp,
+                "after_uuid": page[-1].uuid,
+            }
+        self.assertEqual([len(page) for page in pages], [5, 5, 3])
+        self.assertEqual(sum(pages, []), self.entries)
+
+
+class TestRankedSearch(unittest.TestCase):
+    def setUp(self):
+        self.entry1 = Entry("2001-01-01", "We walked to the castle.", {})
+        self.entry2 = Entry(
+            "2001-01-02", "The Count was walking, walking, walking.", {}
+        )
+        self.entry3 = Entry("2001-01-03", "Dinner at the castle with the Count.", {})
+        self.entry4 = Entry("2001-01-04", "A letter from Mina.", {"mood": 1})
+        self.diary = Diary("name", [self.entry1, self.entry2, self.entry3, self.entry4])
+        create_diary(DB_ADDRESS, self.diary, "username")
+        create_diary(DB_ADDRESS, Diary("other", [Entry("2001", "walk", {})]), "other")
+
+    def tearDown(self) -> None:
+        drop_db(DB_ADDRESS)
+
+    def test_stemmed(self):
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "walks"), [self.entry2, self.entry1]
+        )
+
+    def test_multiple_terms(self):
+        ranked = ranked_search(DB_ADDRESS, "username", "the castle count")
+        self.assertEqual(ranked[0], self.entry3)
+        self.assertCountEqual(ranked, [self.entry1, self.entry2, self.entry3])
+
+    def test_k(self):
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "castle count", k=1), [self.entry3]
+        )
+        self.assertEqual(ranked_search(DB_ADDRESS, "username", "castle", k=0), [])
+
+    def test_no_match(self):
+        self.assertEqual(ranked_search(DB_ADDRESS, "username", "garlic"), [])
+        self.assertEqual(ranked_search(DB_ADDRESS, "username", "the"), [])
+
+    def test_new_entry(self):
+        entry = Entry("2001-01-05", "A letter from Lucy.", {})
+        create_entry(DB_ADDRESS, self.diary.uuid, entry)
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "letters"), [self.entry4, entry]
+        )
+
+    def test_text_updated(self):
+        with db_cursor(DB_ADDRESS) as cur:
+            cur.execute(
+                "UPDATE entry SET text='Garlic flowers' WHERE uuid=?",
+                (self.entry4.uuid,),
+            )
+        self.assertEqual(
+            [e.uuid for e in ranked_search(DB_ADDRESS, "username", "garlic")],
+            [self.entry4.uuid],
+        )
+        self.assertEqual(ranked_search(DB_ADDRESS, "username", "letter"), [])
+
+    def test_entry_deleted(self):
+        with db_cursor(DB_ADDRESS) as cur:
+            cur.execute("DELETE FROM entry WHERE uuid=?", (self.entry1.uuid,))
+            self.assertEqual(
+                cur.execute(
+                    "SELECT entries FROM diary_terms WHERE diary=?", (self.diary.uuid,)
+                ).fetchone(),
+                (3,),
+            )
+        self.assertEqual(ranked_search(DB_ADDRESS, "username", "walk"), [self.entry2])
+
+    def test_unindexed(self):
+        """Entries written without the index, e.g. before it existed, are indexed on
+        the first search."""
+        with db_cursor(DB_ADDRESS) as cur:
+            cur.execute("DELETE FROM posting")
+            cur.execute("DELETE FROM diary_terms")
+            cur.execute("UPDATE entry SET term_count=NULL")
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "walks"), [self.entry2, self.entry1]
+        )
+
+    def test_write_indexes_only_new(self):
+        """Adding an entry doesn't index the rest of the diary, that's left to search."""
+        with db_cursor(DB_ADDRESS) as cur:
+            cur.execute("DELETE FROM posting")
+            cur.execute("DELETE FROM diary_terms")
+            cur.execute("UPDATE entry SET term_count=NULL")
+        entry = Entry("2001-01-05", "A letter from Lucy.", {})
+        with mock.patch("diary.db.tokenize", wraps=tokenize) as counted:
+            create_entry(DB_ADDRESS, self.diary.uuid, entry)
+        counted.assert_called_once_with(entry.text)
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "letters"), [self.entry4, entry]
+        )
+
+    def test_write_without_nltk(self):
+        """Entries are saved without NLTK's data, and indexed once it's there."""
+        entry = Entry("2001-01-05", "A letter from Lucy.", {})
+        with mock.patch("diary.db.tokenize", side_effect=LookupError("stopwords")):
+            create_entry(DB_ADDRESS, self.diary.uuid, entry)
+        self.assertEqual(load_diary(DB_ADDRESS, "username").entries[-1], entry)
+        self.assertEqual(
+            ranked_search(DB_ADDRESS, "username", "letters"), [self.entry4, entry]
+        )
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(max_idle=2)
+
+    def tearDown(self) -> None:
+        self.pool.close()
+        drop_db(DB_ADDRESS)
+
+    def checkout(self) -> sqlite3.Connection:
+        with self.pool.connection(DB_ADDRESS) as con:
+            return con
+
+    def test_reuse(self):
+        self.assertIs(self.checkout(), self.checkout())
+        self.assertEqual(self.pool.opened, 1)
+
+    def test_across_threads(self):
+        """A connection returned by one thread is reused by the next, as a
+        server starting a thread per request would."""
+        connections = []
+        for _ in range(3):
+            thread = threading.Thread(
+                target=lambda: connections.append(self.checkout())
+            )
+            thread.start()
+            thread.join()
+        self.assertIs(connections[0], connections[2])
+        self.assertEqual(self.pool.opened, 1)
+
+    def test_in_use(self):
+        with self.pool.connection(DB_ADDRESS) as con:
+            with self.pool.connection(DB_ADDRESS) as nested:
+                self.assertIs(nested, con)
+            thread = threading.Thread(target=lambda: other.append(self.checkout()))
+            other = []
+            thread.start()
+            thread.join()
+            self.assertIsNot(other[0], con)
+
+    def hold(self, n: int) -> list[sqlite3.Connection]:
+        """Check out n connections at once, each in its own thread, then return them."""
+        connections = []
+        held = threading.Barrier(n + 1)
+        release = threading.Event()
+
+        def check_out():
+            with self.pool.connection(DB_ADDRESS) as con:
+                connections.append(con)
+                held.wait()
+                release.wait()
+
+        threads = [threading.Thread(target=check_out) for _ in range(n)]
+        for thread in threads:
+            thread.start()
+        held.wait()
+        release.set()
+        for thread in threads:
+            thread.join()
+        return connections
+
+    def test_max_idle(self):
+        connections = self.hold(3)
+        self.assertEqual(len(set(connections)), 3)
+        self.assertEqual(self.pool.opened, 3)
+        self.assertLessEqual(set(self.hold(2)), set(connections))
+        self.assertEqual(self.pool.opened, 3)
+        self.hold(3)
+        self.assertEqual(self.pool.opened, 4)
+
+    def test_wal(self):
+        con = self.checkout()
+        self.assertEqual(con.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_close(self):
+        con = self.checkout()
+        self.pool.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            con.execute("SELECT 1")
+        self.assertIsNot(con, self.checkout())
+
+    def test_close_in_use(self):
+        with self.pool.connection(DB_ADDRESS) as con:
+            self.pool.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            con.execute("SELECT 1")
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.diary = Diary("name", [])
+        create_diary(DB_ADDRESS, self.diary, "username")
+
+    def tearDown(self) -> None:
+        drop_db(DB_ADDRESS)
+
+    def test_concurrent(self):
+        transactions = writer.transactions
+        entries = [
+            Entry(f"2001-01-01T00:00:{i:02}", f"entry {i}", {"metric": i})
+            for i in range(40)
+        ]
+        threads = [
+            threading.Thread(
+                target=create_entry, args=(DB_ADDRESS, self.diary.uuid, entry)
+            )
+            for entry in entries
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(load_diary(DB_ADDRESS, "username").entries, entries)
+        self.assertLess(writer.transactions - transactions, 40)
+
+    def test_failure_isolated(self):
+        group = GroupCommitWriter(delay=0.05)
+        self.addCleanup(group.close)
+        errors = []
+
+        def insert(uuid):
+            def work(cur):
+                cur.execute(
+                    "INSERT INTO entry (uuid, diary, timestamp, text) VALUES (?,?,?,?)",
+                    (uuid, self.diary.uuid, "2001-01-01", uuid),
+                )
+                if uuid == "bad":
+                    raise ValueError(uuid)
+
+            try:
+                group.write(DB_ADDRESS, work)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [
+            threading.Thread(target=insert, args=(uuid,))
+            for uuid in ("good1", "bad", "good2")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(group.transactions, 1)
+        texts = [entry.text for entry in load_diary(DB_ADDRESS, "username").entries]
+        self.assertEqual(sorted(texts), ["good1", "good2"])
+
+    def impatient_writer(self, **kwargs) -> GroupCommitWriter:
+        """A writer whose connection waits only 10ms for a lock before retrying,
+        from a pool of its own so it isn't handed one which waits longer"""
+        group = GroupCommitWriter(**kwargs)
+        self.addCleanup(group.close)
+        impatient = ConnectionPool()
+        self.addCleanup(impatient.close)
+        patch = mock.patch("diary.db.pool", impatient)
+        patch.start()
+        self.addCleanup(patch.stop)
+        with mock.patch.dict(PRAGMAS, busy_timeout=10):
+            group.write(DB_ADDRESS, lambda cur: None)
+        blocker = sqlite3.connect(
+            DB_ADDRESS, isolation_level=None, check_same_thread=False
+        )
+        self.addCleanup(blocker.close)
+        blocker.execute("BEGIN IMMEDIATE")
+        self.blocker = blocker
+        return group
+
+    def test_retry(self):
+        group = self.impatient_writer(backoff=0.05)
+        release = threading.Timer(0.2, lambda: self.blocker.execute("COMMIT"))
+        release.start()
+        start = time.perf_counter()
+        self.assertEqual(group.write(DB_ADDRESS, lambda cur: "written"), "written")
+        self.assertGreater(time.perf_counter() - start, 0.15)
+        self.assertGreater(group.retried, 0)
+
+    def test_gives_up(self):
+        group = self.impatient_writer(retries=1, backoff=0.01)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                group.write(DB_ADDRESS, lambda cur: None)
+        finally:
+            self.blocker.execute("ROLLBACK")
+        self.assertEqual(group.retried, 1)
+
+    def test_closed(self):
+        group = GroupCommitWriter()
+        group.write(DB_ADDRESS, lambda cur: None)
+        group.close()
+        with self.assertRaises(RuntimeError):
+            group.write(DB_ADDRESS, lambda cur: None)
+
+
 if __name__ == "__main__":
     unittest.main()
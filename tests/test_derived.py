@@ -0,0 +1,207 @@
+import queue
+import threading
+import unittest
+
+from diary.core import Diary, Entry
+from diary.db import create_diary, create_entry, db_cursor, drop_db, load_diary
+from diary.derived import DerivedMetricWriter
+from diary.nlp import sentiment, sentiment_batch
+
+DB_ADDRESS = "tmp/testing.db"
+
+
+class TestDerivedMetricWriter(unittest.TestCase):
+    def setUp(self):
+        drop_db(DB_ADDRESS)
+        self.diary = Diary("name", [Entry("2001-01-01", "a good day", {"mood": 7})])
+        create_diary(DB_ADDRESS, self.diary, "username")
+        self.writer = DerivedMetricWriter(sentiment_batch)
+
+    def tearDown(self):
+        self.writer.close()
+        drop_db(DB_ADDRESS)
+
+    def add(self, text: str, writer=None) -> Entry:
+        entry = Entry.create(text)
+        create_entry(DB_ADDRESS, self.diary.uuid, entry)
+        (writer or self.writer).submit(DB_ADDRESS, self.diary.uuid, entry)
+        return entry
+
+    def test_written(self):
+        load_diary(DB_ADDRESS, "username")
+        self.add("a terrible day #mood 2")
+        self.writer.drain()
+        entry = load_diary(DB_ADDRESS, "username").entries[-1]
+        self.assertEqual(entry.metrics["mood"], 2)
+        self.assertEqual(
+            entry.metrics["nlp.compound"],
+            sentiment("a terrible day #mood 2")["compound"],
+        )
+        self.assertEqual(
+            {metric for metric in entry.metrics if metric.startswith("nlp.")},
+            {"nlp.neg", "nlp.neu", "nlp.pos", "nlp.compound"},
+        )
+        self.assertEqual(self.writer.written, 1)
+
+    def test_batched(self):
+        batches = []
+
+        def analyse(texts):
+            batches.append(len(texts))
+            return sentiment_batch(texts)
+
+        writer = DerivedMetricWriter(analyse, batch_size=4)
+        try:
+            for i in range(10):
+                self.add(f"entry {i}", writer)
+            writer.drain()
+        finally:
+            writer.close()
+        self.assertEqual(sum(batches), 10)
+        self.assertTrue(all(size <= 4 for size in batches))
+        entries = load_diary(DB_ADDRESS, "username").entries
+        self.assertTrue(all("nlp.compound" in entry.metrics for entry in entries[1:]))
+
+    def test_backpressure(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def analyse(texts):
+            started.set()
+            release.wait()
+            return sentiment_batch(texts)
+
+        writer = DerivedMetricWriter(analyse, max_queued=1, batch_size=1)
+        try:
+            self.add("first", writer)
+            started.wait()
+            self.add("second", writer)
+            entry = Entry.create("third")
+            with self.assertRaises(queue.Full):
+                writer.submit(DB_ADDRESS, self.diary.uuid, entry, timeout=0.01)
+        finally:
+            release.set()
+            writer.close()
+        self.assertEqual(writer.written, 2)
+
+    def test_close_drains(self):
+        for i in range(5):
+            self.add(f"entry {i}")
+        self.writer.close()
+        self.assertEqual(self.writer.written, 5)
+        with self.assertRaises(RuntimeError):
+            self.add("too late")
+
+    def test_failure(self):
+        def analyse(texts):
+            raise LookupError("no model")
+
+        writer = DerivedMetricWriter(analyse)
+        try:
+            with self.assertLogs("diary.derived"):
+                self.add("entry", writer)
+                writer.drain()
+        finally:
+            writer.close()
+        self.assertEqual(writer.failed, 1)
+        self.assertNotIn(
+            "nlp.compound", load_diary(DB_ADDRESS, "username").entries[-1].metrics
+        )
+
+    def test_empty_entry(self):
+        writer = DerivedMetricWriter()
+        try:
+            empty = self.add("", writer)
+            self.add("   ", writer)
+            self.add("a good day", writer)
+            writer.drain()
+        finally:
+            writer.close()
+        self.assertEqual(writer.failed, 0)
+        entries = load_diary(DB_ADDRESS, "username").entries
+        self.assertEqual(entries[1].uuid, empty.uuid)
+        self.assertEqual(entries[1].metrics["nlp.token_count"], 0)
+        self.assertEqual(entries[1].metrics["nlp.words_per_sent"], 0)
+        self.assertIn("nlp.compound", entries[-1].metrics)
+
+    def test_failure_isolated(self):
+        """A text which can't be analysed doesn't lose the rest of its batch."""
+        started = threading.Event()
+        release = threading.Event()
+
+        def analyse(texts):
+            started.set()
+            release.wait()
+            if "bad" in texts:
+                raise ValueError("bad")
+            return sentiment_batch(texts)
+
+        writer = DerivedMetricWriter(analyse)
+        try:
+            self.add("first", writer)
+            started.wait()
+            for text in ("good", "bad", "better"):
+                self.add(text, writer)
+            with self.assertLogs("diary.derived"):
+                release.set()
+                writer.drain()
+        finally:
+            writer.close()
+        self.assertEqual(writer.failed, 1)
+        self.assertEqual(writer.written, 3)
+        metrics = {
+            entry.text: entry.metrics
+            for entry in load_diary(DB_ADDRESS, "username").entries
+        }
+        self.assertNotIn("nlp.compound", metrics["bad"])
+        self.assertIn("nlp.compound", metrics["good"])
+        self.assertIn("nlp.compound", metrics["better"])
+
+    def test_backfill(self):
+        self.add("a terrible day")
+        self.writer.drain()
+        backfill = (DB_ADDRESS, self.diary.uuid, "compound", sentiment_batch)
+        self.assertEqual(self.writer.backfill(*backfill), 1)
+        self.assertEqual(self.writer.backfill(*backfill), 0)
+        entries = load_diary(DB_ADDRESS, "username").entries
+        self.assertEqual(
+            entries[0].metrics["nlp.compound"], sentiment("a good day")["compound"]
+        )
+        self.assertEqual(entries[0].metrics["mood"], 7)
+
+    def test_backfill_failure(self):
+        """An entry which can't be analysed isn't analysed again on every backfill."""
+        analysed = []
+
+        def analyse(texts):
+            analysed.extend(texts)
+            if "bad" in texts:
+                raise ValueError("bad")
+            return sentiment_batch(texts)
+
+        create_entry(DB_ADDRESS, self.diary.uuid, Entry.create("bad"))
+        with self.assertLogs("diary.derived"):
+            written = self.writer.backfill(
+                DB_ADDRESS, self.diary.uuid, "compound", analyse
+            )
+        self.assertEqual(written, 1)
+        self.assertEqual(self.writer.failed, 1)
+        analysed.clear()
+        self.assertEqual(
+            self.writer.backfill(DB_ADDRESS, self.diary.uuid, "compound", analyse), 0
+        )
+        self.assertEqual(analysed, [])
+
+    def test_removed_entry(self):
+        entry = Entry.create("gone")
+        drop_db(DB_ADDRESS)
+        self.writer.submit(DB_ADDRESS, self.diary.uuid, entry)
+        self.writer.drain()
+        with db_cursor(DB_ADDRESS) as cur:
+            rows = cur.execute("SELECT * FROM metric").fetchall()
+        self.assertEqual(rows, [])
+        self.assertEqual(self.writer.written, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
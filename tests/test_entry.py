@@ -1,7 +1,7 @@
 import unittest
 from datetime import datetime, timedelta
 
-from diary.core import Entry
+from diary.core import EMPTY_METRICS, Entry, compact_metrics
 
 
 class TestEntry(unittest.TestCase):
@@ -24,5 +24,23 @@ class TestEntry(unittest.TestCase):
         self.assertEqual(entry.metrics, {"cost": 18, "mood": 5})
 
 
+class TestCompact(unittest.TestCase):
+    def test_slots(self):
+        entry = Entry.create("hello")
+        self.assertFalse(hasattr(entry, "__dict__"))
+
+    def test_shared_empty(self):
+        self.assertIs(Entry.create("hello").metrics, Entry.create("bye").metrics)
+        with self.assertRaises(TypeError):
+            EMPTY_METRICS["metric"] = 1
+
+    def test_interned(self):
+        name = "".join(["mo", "od"])
+        self.assertIs(
+            next(iter(compact_metrics({name: 1}))),
+            next(iter(compact_metrics({"mood": 2}))),
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
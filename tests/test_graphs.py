@@ -0,0 +1,108 @@
+from concurrent.futures.process import BrokenProcessPool
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from diary import graphs
+from diary.graphs import GraphCache, graph_key, render_png
+
+X = np.array(["2001-01-01", "2001-01-02", "2001-01-03"], dtype="datetime64[us]")
+Y = [0.5, -0.25, 1.0]
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+class TestGraphKey(unittest.TestCase):
+    def test_stable(self):
+        self.assertEqual(graph_key("a", X, Y, {}), graph_key("a", X.copy(), Y, {}))
+        self.assertEqual(
+            graph_key("a", X, Y, {}), graph_key("a", X, np.array(Y, "float64"), {})
+        )
+
+    def test_changes(self):
+        key = graph_key("a", X, Y, {})
+        self.assertNotEqual(key, graph_key("b", X, Y, {}))
+        self.assertNotEqual(key, graph_key("a", X, [0.5, -0.25, 1.5], {}))
+        self.assertNotEqual(key, graph_key("a", X[:2], Y[:2], {}))
+        self.assertNotEqual(key, graph_key("a", X, Y, {"dpi": 50}))
+
+
+class TestGraphCache(unittest.TestCase):
+    def test_memory(self):
+        cache = GraphCache()
+        png = cache.png("mood", X, Y)
+        self.assertTrue(png.startswith(PNG_HEADER))
+        self.assertIs(cache.png("mood", X, Y), png)
+        self.assertEqual(cache.renders, 1)
+        self.assertEqual(cache.hit_rate, 0.5)
+        cache.png("mood", X, [1, 2, 3])
+        self.assertEqual(cache.renders, 2)
+
+    def test_evicted(self):
+        cache = GraphCache()
+        size = len(cache.png("a", X, Y))
+        cache = GraphCache(max_bytes=int(size * 1.5))
+        cache.png("a", X, Y)
+        cache.png("b", X, Y)
+        self.assertLessEqual(cache.memory.weight, size * 1.5)
+        cache.png("a", X, Y)
+        self.assertEqual(cache.renders, 3)
+
+    def test_disk(self):
+        with tempfile.TemporaryDirectory() as directory:
+            png = GraphCache(directory=directory).png("mood", X, Y, dpi=50)
+            cache = GraphCache(directory=directory)
+            self.assertEqual(cache.png("mood", X, Y, dpi=50), png)
+            self.assertEqual((cache.renders, cache.disk_hits), (0, 1))
+            self.assertEqual(cache.hit_rate, 1.0)
+
+    def test_disk_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            size = len(GraphCache().png("0", X, Y, dpi=50))
+            cache = GraphCache(directory=directory, max_disk_bytes=size * 3)
+            for name in "0123456":
+                cache.png(name, X, Y, dpi=50)
+            files = os.listdir(directory)
+            self.assertLessEqual(len(files), 3)
+            self.assertIn(graph_key("6", X, Y, {"dpi": 50}) + ".png", files)
+
+
+class TestRenderAll(unittest.TestCase):
+    def setUp(self):
+        self.graphs = {f"metric{i}": (X, np.array(Y) * i) for i in range(4)}
+
+    def test_parallel(self):
+        cache = GraphCache()
+        pngs = cache.render_all(self.graphs, dpi=50)
+        self.assertEqual(pngs.keys(), self.graphs.keys())
+        for name, (X_i, Y_i) in self.graphs.items():
+            self.assertEqual(pngs[name], render_png(X_i, Y_i, dpi=50))
+            self.assertIs(cache.png(name, X_i, Y_i, dpi=50), pngs[name])
+
+    def test_cached(self):
+        cache = GraphCache()
+        png = cache.png("metric1", *self.graphs["metric1"])
+        pngs = cache.render_all(self.graphs, timeout=0)
+        self.assertIs(pngs["metric1"], png)
+
+    def test_timeout(self):
+        """Graphs which aren't ready in time are cached once they are."""
+        cache = GraphCache()
+        cache.render_all(self.graphs, timeout=0)
+        pngs = cache.render_all(self.graphs)
+        self.assertEqual(len(pngs), 4)
+        for name, (X_i, Y_i) in self.graphs.items():
+            self.assertIs(cache.png(name, X_i, Y_i), pngs[name])
+        # graphs still rendering weren't rendered again
+        self.assertLessEqual(cache.renders, 4)
+
+    def test_broken_pool(self):
+        with self.assertRaises(BrokenProcessPool):
+            graphs.workers.submit(os._exit, 1).result()
+        pngs = GraphCache().render_all(self.graphs)
+        self.assertEqual(pngs.keys(), self.graphs.keys())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from diary.migrations import MIGRATIONS, add_metric_names, migrate, schema_version
+from diary.search import EntryQuery
+
+
+class TestMigrate(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.con = sqlite3.connect(os.path.join(self.tmpdir.name, "test.db"))
+
+    def tearDown(self):
+        self.con.close()
+        self.tmpdir.cleanup()
+
+    def test_new_db(self):
+        self.assertEqual(migrate(self.con), len(MIGRATIONS))
+        self.assertEqual(schema_version(self.con), len(MIGRATIONS))
+
+    def test_idempotent(self):
+        migrate(self.con)
+        migrate(self.con)
+        self.assertEqual(schema_version(self.con), len(MIGRATIONS))
+
+    def test_upgrade_unversioned(self):
+        """A database from before migrations existed keeps its data."""
+        with self.con:
+            self.con.execute(
+                "CREATE TABLE diary (uuid TEXT PRIMARY KEY, username TEXT UNIQUE, name TEXT)"
+            )
+            self.con.execute(
+                "CREATE TABLE entry (uuid TEXT PRIMARY KEY, diary TEXT, timestamp TEXT, text TEXT)"
+            )
+            self.con.execute(
+                "CREATE TABLE metric (entry TEXT, metric TEXT, value REAL)"
+            )
+            self.con.execute("INSERT INTO diary VALUES ('d', 'username', 'name')")
+            self.con.execute(
+                "INSERT INTO entry VALUES ('e', 'd', '2001-01-01', 'text #mood 1')"
+            )
+            self.con.execute("INSERT INTO metric VALUES ('e', 'mood', 1)")
+        migrate(self.con)
+        self.assertEqual(
+            self.con.execute("SELECT timestamp, text FROM entry").fetchall(),
+            [("2001-01-01", "text #mood 1")],
+        )
+        self.assertEqual(
+            self.con.execute(
+                """SELECT name, value FROM metric
+                JOIN metric_name ON metric_name.id=metric.metric"""
+            ).fetchall(),
+            [("mood", 1)],
+        )
+
+    def test_indexed_load(self):
+        migrate(self.con)
+        plan = self.con.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM entry WHERE diary=? ORDER BY timestamp",
+            ("d",),
+        ).fetchall()
+        self.assertIn("USING INDEX entry_diary", str(plan))
+        self.assertNotIn("TEMP B-TREE", str(plan))
+
+    def test_metric_names(self):
+        """Metrics from before metric_name keep their values, and stay rolled up."""
+        version = MIGRATIONS.index(add_metric_names)
+        with self.con:
+            for func in MIGRATIONS[:version]:
+                func(self.con)
+            self.con.execute(f"PRAGMA user_version = {version}")
+            self.con.execute("INSERT INTO diary VALUES ('d', 'username', 'name')")
+            self.con.executemany(
+                "INSERT INTO entry (uuid, diary, timestamp, text) VALUES (?,'d',?,'')",
+                [("e1", "2001-01-01"), ("e2", "2001-01-02")],
+            )
+            self.con.executemany(
+                "INSERT INTO metric VALUES (?, ?, ?)",
+                [
+                    ("e1", "mood", 1),
+                    ("e1", "sleep", 8),
+                    ("e2", "mood", 2),
+                    ("e2", "mood", 3),
+                    ("missing", "ghost", 4),
+                ],
+            )
+        migrate(self.con)
+        self.assertEqual(
+            self.con.execute("SELECT name FROM metric_name ORDER BY id").fetchall(),
+            [("mood",), ("sleep",)],
+        )
+        values = """SELECT uuid, name, value FROM metric
+            JOIN entry ON entry.id=metric.entry
+            JOIN metric_name ON metric_name.id=metric.metric ORDER BY uuid, name"""
+        self.assertEqual(
+            self.con.execute(values).fetchall(),
+            [("e1", "mood", 1), ("e1", "sleep", 8), ("e2", "mood", 3)],
+        )
+        rollups = """SELECT metric, count, total, minimum, maximum FROM metric_rollup
+            WHERE resolution='month' ORDER BY metric"""
+        self.assertEqual(
+            self.con.execute(rollups).fetchall(),
+            [("mood", 2, 4, 1, 3), ("sleep", 1, 8, 8, 8)],
+        )
+        with self.con:
+            self.con.execute("INSERT INTO metric VALUES (2, 2, 6)")
+        self.assertEqual(
+            self.con.execute(rollups).fetchall(),
+            [("mood", 2, 4, 1, 3), ("sleep", 2, 14, 6, 8)],
+        )
+        with self.con:
+            self.con.execute("DELETE FROM entry WHERE uuid='e1'")
+        self.assertEqual(
+            self.con.execute(values).fetchall(), [("e2", "mood", 3), ("e2", "sleep", 6)]
+        )
+        self.assertEqual(
+            self.con.execute(rollups).fetchall(),
+            [("mood", 1, 3, 3, 3), ("sleep", 1, 6, 6, 6)],
+        )
+        self.assertEqual(
+            self.con.execute(
+                """SELECT count(*) FROM metric_rollup
+                WHERE resolution='day' AND bucket='2001-01-01'"""
+            ).fetchone(),
+            (0,),
+        )
+
+    def test_indexed_metric_filter(self):
+        migrate(self.con)
+        where, params = EntryQuery(metric="mood", gt=3).compile()
+        plan = self.con.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM entry WHERE {where}", params
+        ).fetchall()
+        self.assertIn("USING COVERING INDEX metric_value", str(plan))
+
+
+if __name__ == "__main__":
+    unittest.main()
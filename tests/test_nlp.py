@@ -1,6 +1,21 @@
+from concurrent.futures.process import BrokenProcessPool
+import os
+import subprocess
+import sys
 import unittest
+from unittest import mock
 
-from diary.nlp import tokenize, strip_punc, sentiment, stats
+from diary import nlp
+from diary.nlp import (
+    Analysis,
+    ensure_resource,
+    tokenize,
+    strip_punc,
+    sentiment,
+    sentiment_batch,
+    stats,
+    stats_batch,
+)
 
 
 class TestPipelines(unittest.TestCase):
@@ -60,6 +75,14 @@ class TestPipelines(unittest.TestCase):
         self.assertGreater(neg["neg"], 0)
         self.assertEqual(neg["pos"], 0)
 
+    def test_empty_stats(self):
+        for para in ("", "  \n "):
+            result = stats(para)
+            self.assertEqual(result["token_count"], 0)
+            self.assertEqual(result["letters_per_word"], 0)
+            self.assertEqual(result["words_per_sent"], 0)
+            self.assertEqual(result["content_per_sent"], 0)
+
     def test_stats(self):
         self.assertEqual(
             stats(self.para),
@@ -76,3 +99,81 @@ class TestPipelines(unittest.TestCase):
                 "words_per_sent": 17.5,
             },
         )
+
+    def test_analysis(self):
+        analysis = Analysis(self.para)
+        self.assertEqual(analysis.stats(), stats(self.para))
+        self.assertEqual(len(analysis.sents), 2)
+        self.assertEqual(analysis.content_lemmas, tokenize(self.para))
+        self.assertEqual(
+            analysis.timings.keys(),
+            {"sents", "tokens", "content_lemmas", "sentiment"},
+        )
+
+    def test_contractions(self):
+        """Content lemmas come from the words already found, split contractions and
+        all, rather than from tokenising the paragraph again."""
+        analysis = Analysis("I don't know, we'll see.")
+        with mock.patch.object(nlp, "tokenize") as tokenize:
+            self.assertEqual(analysis.content_lemmas, ["know", "see"])
+        tokenize.assert_not_called()
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.texts = [
+            "What a wonderful day.",
+            "I feared to go very far from the station.",
+            "Left Munich at 8:35 P. M., on 1st May.",
+        ] * 5
+
+    def test_sentiment_batch(self):
+        self.assertEqual(
+            sentiment_batch(self.texts, chunk_size=2),
+            [sentiment(text) for text in self.texts],
+        )
+
+    def test_stats_batch(self):
+        self.assertEqual(
+            stats_batch(self.texts, chunk_size=4),
+            [stats(text) for text in self.texts],
+        )
+
+    def test_broken_pool(self):
+        with self.assertRaises(BrokenProcessPool):
+            nlp.workers.submit(os._exit, 1).result()
+        self.assertEqual(
+            sentiment_batch(self.texts, chunk_size=2),
+            [sentiment(text) for text in self.texts],
+        )
+
+    def test_small_batch(self):
+        self.assertEqual(sentiment_batch(self.texts[:1]), [sentiment(self.texts[0])])
+        self.assertEqual(sentiment_batch([]), [])
+
+
+class TestLazy(unittest.TestCase):
+    def test_import(self):
+        """Importing the app shouldn't load NLTK or the plotting libraries."""
+        loaded = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                "import sys, diary.app; print(*sorted(sys.modules))",
+            ],
+            text=True,
+        ).split()
+        for module in ("nltk", "numpy", "matplotlib"):
+            self.assertNotIn(module, loaded)
+
+
+class TestResources(unittest.TestCase):
+    def test_download_once(self):
+        """A package which can't be downloaded isn't tried again on every use."""
+        self.addCleanup(nlp._missing_resource.cache_clear)
+        with mock.patch.dict(nlp.RESOURCES, {"missing": "corpora/missing"}):
+            with mock.patch("nltk.download") as download:
+                for _ in range(3):
+                    with self.assertRaises(LookupError):
+                        ensure_resource("missing")
+        download.assert_called_once_with("missing", quiet=True)
@@ -1,7 +1,18 @@
 import unittest
 
 from diary.core import Diary, Entry
-from diary.search import strict_search, date_filter, metric_filter
+from diary.db import create_diary, db_cursor, drop_db
+from diary.search import (
+    DiaryIndex,
+    EntryQuery,
+    TrigramIndex,
+    strict_search,
+    date_filter,
+    metric_filter,
+    within_distance,
+)
+
+DB_ADDRESS = "tmp/testing.db"
 
 entry1 = Entry("2001-12-25", "spam", {})
 entry2 = Entry("2002-12-25", "spam eggs", {"metric": 0})
@@ -30,6 +41,52 @@ class TestStrictSeach(unittest.TestCase):
         self.assertEqual(strict_search(diary, "spam egg"), [entry2, entry4])
 
 
+class TestTrigramIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = TrigramIndex(diary)
+
+    def test_matches_strict_search(self):
+        for term in ("spam", "egg", "spam egg", "eggs bean", "ham", "gs", "s", ""):
+            with self.subTest(term=term):
+                self.assertEqual(self.index.search(term), strict_search(diary, term))
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.index.search("SPAM EGG"), [entry2, entry4])
+        self.assertEqual(self.index.search("Gs"), [entry2, entry3])
+
+    def test_new_entries(self):
+        grown = Diary("name", list(all_entries))
+        index = TrigramIndex(grown)
+        self.assertEqual(index.search("toast"), [])
+        grown.add("Spam on toast")
+        self.assertEqual(index.search("toast"), [grown.entries[-1]])
+        self.assertEqual(len(index.search("spam")), 5)
+
+    def test_fuzzy(self):
+        exercise = Entry("2005-01-01", "Went for some Exercise today", {})
+        index = TrigramIndex(Diary("name", all_entries + [exercise]))
+        self.assertEqual(index.fuzzy_search("exersize", 2), [exercise])
+        self.assertEqual(index.fuzzy_search("exersize", 1), [])
+        self.assertEqual(index.fuzzy_search("sausages"), [entry3])
+        self.assertEqual(index.fuzzy_search("eggs", 0), [entry2, entry3])
+
+    def test_fuzzy_short(self):
+        self.assertEqual(self.index.fuzzy_search("spm"), all_entries)
+
+    def test_fuzzy_words(self):
+        self.assertEqual(self.index.fuzzy_search("beams spat"), [entry3, entry4])
+        self.assertEqual(self.index.fuzzy_search("beams spat ham"), [])
+        self.assertEqual(self.index.fuzzy_search(""), [])
+
+    def test_within_distance(self):
+        self.assertTrue(within_distance("exercise", "exercise", 0))
+        self.assertTrue(within_distance("exersize", "exercise", 2))
+        self.assertFalse(within_distance("exersize", "exercise", 1))
+        self.assertTrue(within_distance("ab", "", 2))
+        self.assertFalse(within_distance("ab", "", 1))
+        self.assertFalse(within_distance("abcdef", "fedcba", 3))
+
+
 class TestDateFilter(unittest.TestCase):
     def test_before(self):
         self.assertEqual(
@@ -58,5 +115,111 @@ class TestMetricFilter(unittest.TestCase):
         self.assertEqual(metric_filter(all_entries, "metric", eq=10), [entry4])
 
 
+class TestDiaryIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = DiaryIndex(diary)
+
+    def test_date_filter(self):
+        dates = [None, "", "2001", "2002-12-25", "2003-06-01", "2004-12-25", "2005"]
+        for before in dates:
+            for after in dates:
+                with self.subTest(before=before, after=after):
+                    self.assertEqual(
+                        self.index.date_filter(before=before, after=after),
+                        date_filter(all_entries, before=before, after=after),
+                    )
+
+    def test_metric_filter(self):
+        bounds = [None, -1, 0, 5, 10, 11]
+        for metric in ("metric", "tag", "missing"):
+            for gt in bounds:
+                for lt in bounds:
+                    for eq in bounds:
+                        with self.subTest(metric=metric, gt=gt, lt=lt, eq=eq):
+                            self.assertEqual(
+                                self.index.metric_filter(metric, gt=gt, lt=lt, eq=eq),
+                                metric_filter(all_entries, metric, gt=gt, lt=lt, eq=eq),
+                            )
+
+    def test_add(self):
+        grown = Diary("name", list(all_entries))
+        index = DiaryIndex(grown)
+        self.assertEqual(index.metric_filter("metric", gt=5), [entry4])
+        grown.add("#metric 7")
+        self.assertEqual(index.metric_filter("metric", gt=5), grown.entries[-2:])
+        self.assertEqual(index.date_filter(after="2005"), grown.entries[-1:])
+
+    def test_out_of_order(self):
+        shuffled = Diary("name", [entry3, entry1, entry4, entry2])
+        index = DiaryIndex(shuffled)
+        self.assertEqual(index.date_filter(after="2002"), [entry3, entry4, entry2])
+        self.assertEqual(index.metric_filter("metric", lt=20), [entry4, entry2])
+
+
+class TestEntryQuery(unittest.TestCase):
+    queries = [
+        EntryQuery(),
+        EntryQuery(search_term="spam"),
+        EntryQuery(search_term="egg"),
+        EntryQuery(search_term="gs"),
+        EntryQuery(search_term="Spam"),
+        EntryQuery(search_term='spam "egg'),
+        EntryQuery(search_term="spam egg", after="2002-12-25"),
+        EntryQuery(before="2004-12-25", after="2001-12-25"),
+        EntryQuery(metric="metric"),
+        EntryQuery(metric="metric", gt=5),
+        EntryQuery(metric="metric", lt=5),
+        EntryQuery(metric="metric", eq=10),
+        EntryQuery(metric="metric", gt=5, lt=6),
+        EntryQuery(search_term="beans", metric="tag", before="2004-01-01"),
+        EntryQuery(metric="absent"),
+    ]
+
+    def setUp(self):
+        create_diary(DB_ADDRESS, diary, "username")
+        create_diary(DB_ADDRESS, Diary("other", [Entry("2002", "spam", {})]), "other")
+
+    def tearDown(self) -> None:
+        drop_db(DB_ADDRESS)
+
+    def test_filter(self):
+        self.assertEqual(
+            EntryQuery(search_term="spam", metric="metric", gt=5).filter(diary),
+            [entry4],
+        )
+
+    def test_execute(self):
+        self.assertEqual(
+            EntryQuery(search_term="spam", metric="metric", gt=5).execute(
+                DB_ADDRESS, "username"
+            ),
+            [entry4],
+        )
+
+    def test_text_updated(self):
+        with db_cursor(DB_ADDRESS) as cur:
+            cur.execute("UPDATE entry SET text='ham' WHERE uuid=?", (entry1.uuid,))
+        self.assertEqual(
+            EntryQuery(search_term="spam").execute(DB_ADDRESS, "username"),
+            [entry2, entry3, entry4],
+        )
+        self.assertEqual(
+            [
+                entry.uuid
+                for entry in EntryQuery(search_term="ham").execute(
+                    DB_ADDRESS, "username"
+                )
+            ],
+            [entry1.uuid],
+        )
+
+    def test_consistent(self):
+        for query in self.queries:
+            with self.subTest(query=query):
+                self.assertEqual(
+                    query.execute(DB_ADDRESS, "username"), query.filter(diary)
+                )
+
+
 if __name__ == "__main__":
     unittest.main()
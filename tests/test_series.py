@@ -0,0 +1,232 @@
+import unittest
+import warnings
+from unittest import mock
+
+import numpy as np
+
+from diary.core import Diary, Entry
+from diary.db import create_diary, create_entry, drop_db
+from diary.series import (
+    load_metric_rollups,
+    load_metric_series,
+    lttb,
+    metric_series,
+    to_datetime64,
+)
+
+DB_ADDRESS = "tmp/testing.db"
+
+entry1 = Entry("2001-12-25", "spam", {})
+entry2 = Entry("2002-12-25", "spam eggs", {"metric": 0})
+entry3 = Entry("2003-12-25", "eggs beans sausage spam", {"tag": 1})
+entry4 = Entry("2004-12-25", "beans spam egg spam", {"metric": 10})
+diary = Diary("name", [entry1, entry2, entry3, entry4])
+
+
+class TestToDatetime64(unittest.TestCase):
+    def test_iso(self):
+        np.testing.assert_array_equal(
+            to_datetime64(["2001-12-25", "2002-12-25T10:30:00.5"]),
+            np.array(["2001-12-25", "2002-12-25T10:30:00.5"], dtype="datetime64[us]"),
+        )
+
+    def test_offset(self):
+        np.testing.assert_array_equal(
+            to_datetime64(["2001-12-25", "2001-12-25 00:00:00-06:39"]),
+            np.array(["2001-12-25", "2001-12-25T06:39"], dtype="datetime64[us]"),
+        )
+
+    def test_offset_deprecated(self):
+        """Older numpy parses an offset with a DeprecationWarning rather than a
+        UserWarning"""
+        array = np.array
+
+        def deprecated_offsets(values, *args, **kwargs):
+            if any(isinstance(value, str) and "-06:39" in value for value in values):
+                warnings.warn("parsing timezone aware datetimes", DeprecationWarning)
+            return array(values, *args, **kwargs)
+
+        with mock.patch.object(np, "array", deprecated_offsets):
+            times = to_datetime64(["2001-12-25", "2001-12-25 00:00:00-06:39"])
+        np.testing.assert_array_equal(
+            times,
+            np.array(["2001-12-25", "2001-12-25T06:39"], dtype="datetime64[us]"),
+        )
+
+
+class TestSeries(unittest.TestCase):
+    def assertSeriesEqual(self, series, expected):
+        self.assertEqual(series.keys(), expected.keys())
+        for metric, (X, Y) in expected.items():
+            np.testing.assert_array_equal(series[metric][0], to_datetime64(X))
+            np.testing.assert_array_equal(series[metric][1], Y)
+
+    def test_metric_series(self):
+        self.assertSeriesEqual(
+            metric_series(diary.entries),
+            {
+                "metric": (["2002-12-25", "2004-12-25"], [0, 10]),
+                "tag": (["2003-12-25"], [1]),
+            },
+        )
+
+    def test_diary_methods(self):
+        diary = Diary("name", [entry1, entry2])
+        self.assertEqual(len(diary.timestamps()), 2)
+        self.assertIs(diary.metric_series(), diary.metric_series())
+        diary.add("new #tag 3")
+        self.assertEqual(len(diary.timestamps()), 3)
+        np.testing.assert_array_equal(diary.metric_series()["tag"][1], [3])
+
+    def test_load_metric_series(self):
+        create_diary(DB_ADDRESS, diary, "username")
+        try:
+            self.assertSeriesEqual(
+                load_metric_series(DB_ADDRESS, "username"),
+                metric_series(diary.entries),
+            )
+        finally:
+            drop_db(DB_ADDRESS)
+
+
+class TestRollups(unittest.TestCase):
+    def setUp(self):
+        self.diary = Diary(
+            "name",
+            [
+                Entry("2024-05-13T08:00:00", "", {"weight": 70.0}),
+                Entry("2024-05-13T20:00:00", "", {"weight": 71.0, "mood": 3}),
+                Entry("2024-05-19T23:00:00", "", {"weight": 72.0}),
+                # a Sunday night in UTC-5 is Monday in UTC, the next week
+                Entry("2024-05-19T23:00:00-05:00", "", {"weight": 69.0}),
+                Entry("2024-06-01", "", {"weight": 75.0}),
+                Entry("2024", "unparseable as a date", {"weight": 1.0}),
+            ],
+        )
+        create_diary(DB_ADDRESS, self.diary, "username")
+
+    def tearDown(self):
+        drop_db(DB_ADDRESS)
+
+    def assertRollup(self, rollup, times, count, total, minimum, maximum):
+        np.testing.assert_array_equal(rollup.times, np.array(times, "datetime64[D]"))
+        np.testing.assert_array_equal(rollup.count, count)
+        np.testing.assert_array_equal(rollup.total, total)
+        np.testing.assert_array_equal(rollup.minimum, minimum)
+        np.testing.assert_array_equal(rollup.maximum, maximum)
+
+    def test_day(self):
+        rollups = load_metric_rollups(DB_ADDRESS, "username", "day")
+        self.assertEqual(rollups.keys(), {"weight", "mood"})
+        self.assertRollup(
+            rollups["weight"],
+            ["2024-05-13", "2024-05-19", "2024-05-20", "2024-06-01"],
+            [2, 1, 1, 1],
+            [141, 72, 69, 75],
+            [70, 72, 69, 75],
+            [71, 72, 69, 75],
+        )
+        np.testing.assert_array_equal(rollups["weight"].mean, [70.5, 72, 69, 75])
+
+    def test_week(self):
+        self.assertRollup(
+            load_metric_rollups(DB_ADDRESS, "username", "week")["weight"],
+            ["2024-05-13", "2024-05-20", "2024-05-27"],
+            [3, 1, 1],
+            [213, 69, 75],
+            [70, 69, 75],
+            [72, 69, 75],
+        )
+
+    def test_month(self):
+        self.assertRollup(
+            load_metric_rollups(DB_ADDRESS, "username", "month")["mood"],
+            ["2024-05-01"],
+            [1],
+            [3],
+            [3],
+            [3],
+        )
+
+    def test_incremental(self):
+        create_entry(
+            DB_ADDRESS, self.diary.uuid, Entry("2024-06-02T12:00", "", {"weight": 74})
+        )
+        self.assertRollup(
+            load_metric_rollups(DB_ADDRESS, "username", "month")["weight"],
+            ["2024-05-01", "2024-06-01"],
+            [4, 2],
+            [282, 149],
+            [69, 74],
+            [72, 75],
+        )
+
+    def test_resolution(self):
+        with self.assertRaises(ValueError):
+            load_metric_rollups(DB_ADDRESS, "username", "hour")
+
+
+def reference_lttb(data, threshold):
+    """Largest-Triangle-Three-Buckets as published by Steinarsson, point by point."""
+    every = (len(data) - 2) / (threshold - 2)
+    a = 0
+    sampled = [data[0]]
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(data))
+        avg_x = sum(x for x, _ in data[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y for _, y in data[avg_start:avg_end]) / (avg_end - avg_start)
+        max_area = -1
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs(
+                (data[a][0] - avg_x) * (data[j][1] - data[a][1])
+                - (data[a][0] - data[j][0]) * (avg_y - data[a][1])
+            )
+            if area > max_area:
+                max_area, next_a = area, j
+        sampled.append(data[next_a])
+        a = next_a
+    sampled.append(data[-1])
+    return sampled
+
+
+class TestLTTB(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.X = np.sort(rng.uniform(0, 1000, 1001))
+        self.Y = np.cumsum(rng.normal(size=1001))
+
+    def test_reference(self):
+        for points in (3, 4, 10, 99, 500, 1000):
+            with self.subTest(points=points):
+                X, Y = lttb(self.X, self.Y, points)
+                self.assertEqual(len(X), points)
+                expected = reference_lttb(list(zip(self.X, self.Y)), points)
+                np.testing.assert_allclose(np.column_stack([X, Y]), expected)
+
+    def test_short(self):
+        X, Y = lttb(self.X[:10], self.Y[:10], 10)
+        np.testing.assert_array_equal(X, self.X[:10])
+        X, Y = lttb(self.X, self.Y, 2)
+        self.assertEqual(len(X), len(self.X))
+
+    def test_keeps_peaks(self):
+        Y = np.zeros(10_000)
+        Y[1234] = 100
+        Y[8765] = -100
+        X, Y = lttb(np.arange(10_000), Y, 50)
+        self.assertIn(1234, X)
+        self.assertIn(8765, X)
+        self.assertEqual((X[0], X[-1]), (0, 9999))
+
+    def test_datetime(self):
+        times = to_datetime64([f"2001-01-{day:02d}" for day in range(1, 32)])
+        X, Y = lttb(times, list(range(31)), 5)
+        self.assertEqual(X.dtype, times.dtype)
+        self.assertEqual(X[0], times[0])
+        self.assertEqual(X[-1], times[-1])
+        self.assertEqual(Y.dtype, np.float64)
+
+
+if __name__ == "__main__":
+    unittest.main()
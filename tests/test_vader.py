@@ -0,0 +1,92 @@
+import unittest
+
+from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+from diary.core import Diary
+from diary.nlp import ensure_resource
+from diary.vader import FastSentimentAnalyzer
+
+EDGE_CASES = [
+    "",
+    "   ",
+    "a",
+    "good",
+    "GOOD",
+    "The food is GOOD, the service is bad.",
+    "VERY GOOD",
+    "not good",
+    "isn't good",
+    "This isn't very good at all.",
+    "never so good",
+    "never this bad",
+    "it was never so very good",
+    "so very good",
+    "at least good",
+    "very least good",
+    "the least good",
+    "least good",
+    "It was kind of good",
+    "kind of",
+    "good but bad",
+    "GOOD BUT bad, but ok",
+    "good good good bad good",
+    "Great!",
+    "Great!!!!!!",
+    "Great??",
+    "Great???",
+    "Great?????",
+    "Terrible!?!?",
+    "I'm :) today but :( tomorrow",
+    "'good' \"bad\" (nice) [awful] ...fine...",
+    "good, bad; nice: awful. fine! great? sad-",
+    "yeah right, that was the bomb",
+    "he cut the mustard, hand to mouth",
+    "she kiss of death back handed",
+    "it was the shit",
+    "extremely UTTERLY terrible",
+    "damn good but not bad",
+    "I don't hate it, I wasn't sad and it's not unhappy",
+    "Without doubt, nothing was ever less good",
+    "NEVER SO GOOD",
+    "Émile was très happy — ünïcode ☺ sad",
+]
+
+
+class TestConformance(unittest.TestCase):
+    """The fast analyser should score exactly as nltk's does."""
+
+    @classmethod
+    def setUpClass(cls):
+        ensure_resource("vader_lexicon")
+        cls.nltk = SentimentIntensityAnalyzer()
+        cls.fast = FastSentimentAnalyzer.load()
+
+    def assertConforms(self, texts):
+        for text in texts:
+            with self.subTest(text=text[:80]):
+                self.assertEqual(
+                    self.fast.polarity_scores(text), self.nltk.polarity_scores(text)
+                )
+
+    def test_lexicon(self):
+        self.assertEqual(self.fast.lexicon, self.nltk.lexicon)
+
+    def test_edge_cases(self):
+        self.assertConforms(EDGE_CASES)
+
+    def test_corpus(self):
+        with open("tests/dracula.diary", "r") as f:
+            diary = Diary.load(f)
+        paragraphs = [entry.text for entry in diary.entries]
+        lines = [line for text in paragraphs for line in text.splitlines()]
+        self.assertConforms(paragraphs + lines)
+
+    def test_batch(self):
+        self.assertEqual(
+            self.fast.polarity_scores_batch(EDGE_CASES),
+            [self.nltk.polarity_scores(text) for text in EDGE_CASES],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
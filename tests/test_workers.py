@@ -0,0 +1,39 @@
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from diary.workers import WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    def setUp(self):
+        self.workers = WorkerPool()
+        self.addCleanup(lambda: self.workers.get().shutdown())
+
+    def test_reused(self):
+        self.assertIs(self.workers.get(), self.workers.get())
+        self.assertEqual(self.workers.map(abs, [-1, -2]), [1, 2])
+
+    def test_submit_broken(self):
+        """A worker dying fails its own task, and the pool is replaced for the next."""
+        broken = self.workers.get()
+        with self.assertRaises(BrokenProcessPool):
+            self.workers.submit(os._exit, 1).result()
+        self.assertEqual(self.workers.submit(abs, -1).result(), 1)
+        self.assertIsNot(self.workers.get(), broken)
+
+    def test_map_broken(self):
+        with self.assertRaises(BrokenProcessPool):
+            self.workers.map(os._exit, [1])
+        self.assertEqual(self.workers.map(abs, [-1, -2]), [1, 2])
+
+    def test_submit_to_broken(self):
+        """A pool which broke without a task noticing is replaced on submit."""
+        broken = self.workers.get()
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        self.assertEqual(self.workers.submit(abs, -1).result(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()